@@ -1,11 +1,32 @@
 import os
 import tempfile
+import codecs
+import collections
+import contextlib
+import functools
+import csv
+import hashlib
+import itertools
+import json
+import graphlib
+import gzip
+import types
+import zipfile
+import zlib
+import multiprocessing
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import numpy as np
 import asyncio
 import asyncpg
 import asyncssh
 import time
-from io import StringIO
+import io
+from io import StringIO, BytesIO
 import logging
 from datetime import datetime, date
 from typing import List, Dict, Any, Optional
@@ -31,7 +52,42 @@ SFTP_HOST = os.getenv("SFTP_HOST")
 SFTP_USER = os.getenv("SFTP_USER")
 SFTP_PASS = os.getenv("SFTP_PASS")
 SFTP_PATH = os.getenv("SFTP_PATH")
+SFTP_KEEPALIVE_INTERVAL = int(os.getenv("SFTP_KEEPALIVE_INTERVAL", "30"))  # Seconds between SSH keepalives
+SFTP_BLOCK_SIZE = int(os.getenv("SFTP_BLOCK_SIZE", "16384"))  # Bytes per SFTP read request
+SFTP_MAX_REQUESTS = int(os.getenv("SFTP_MAX_REQUESTS", "128"))  # SFTP read requests in flight per transfer
+SFTP_CONNECTIONS = int(os.getenv("SFTP_CONNECTIONS", "1"))  # SSH connections transfers are spread over
+SFTP_SPLIT_THRESHOLD_MB = float(os.getenv("SFTP_SPLIT_THRESHOLD_MB", "256"))  # Download files this large in ranges
+SFTP_SPLIT_PARTS = int(os.getenv("SFTP_SPLIT_PARTS", "4"))  # Concurrent ranged reads per split file
+STREAM_FROM_SFTP = os.getenv("STREAM_FROM_SFTP", "false").lower() == "true"  # Import without temporary files
+STREAM_BUFFER_MB = int(os.getenv("STREAM_BUFFER_MB", "16"))  # Read-ahead buffered per streamed file
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR")  # Keep downloads here so interrupted ones resume on the next run
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))  # Resumed attempts after an interrupted download
+DOWNLOAD_RETRY_DELAY = float(os.getenv("DOWNLOAD_RETRY_DELAY", "2"))  # Seconds before the first retry, doubled after
+VERIFY_CHECKSUMS = os.getenv("VERIFY_CHECKSUMS", "true").lower() == "true"  # Check downloads against <file>.sha256
+MAX_FILES_IN_FLIGHT = int(os.getenv("MAX_FILES_IN_FLIGHT", "0"))  # Files downloaded but not yet imported, 0 for no limit
+STREAM_BLOCK_SIZE = 1024 * 1024  # Bytes per SFTP read of a streamed file
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "10000"))  # Number of rows per chunk
+ENCODING_SAMPLE_BYTES = int(os.getenv("ENCODING_SAMPLE_BYTES", str(1024 * 1024)))  # Bytes sampled to detect encoding
+SKIP_UNCHANGED = os.getenv("SKIP_UNCHANGED", "true").lower() == "true"  # Skip files imported unchanged before
+MANIFEST_TABLE = os.getenv("MANIFEST_TABLE", "csv_import_manifest")  # Control table of imported files
+LOAD_METHOD = os.getenv("LOAD_METHOD", "copy").lower()  # "copy" or "insert"
+COPY_PASSTHROUGH = os.getenv("COPY_PASSTHROUGH", "false").lower() == "true"  # Let PostgreSQL parse matching files
+LOAD_STRATEGY = os.getenv("LOAD_STRATEGY", "truncate").lower()  # "truncate", "swap" or "merge"
+MERGE_DELETE_MISSING = os.getenv("MERGE_DELETE_MISSING", "false").lower() == "true"  # Delete rows absent from the file
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))  # Chunks buffered between pipeline stages
+MAX_CONCURRENT_TABLES = int(os.getenv("MAX_CONCURRENT_TABLES", "3"))  # Tables loaded in parallel
+PARALLEL_FILE_THRESHOLD_MB = float(os.getenv("PARALLEL_FILE_THRESHOLD_MB", "256"))  # Split files at least this large
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", str(os.cpu_count() or 1)))  # Parser processes per split file
+PARALLEL_WRITERS = int(os.getenv("PARALLEL_WRITERS", "4"))  # Pool connections writing one split file
+PARALLEL_RANGE_MB = float(os.getenv("PARALLEL_RANGE_MB", "16"))  # Size of each byte range of a split file
+PARSER_ENGINE = os.getenv("PARSER_ENGINE", "pandas").lower()  # "pandas", "pyarrow" or "csv"
+# Per-table parser overrides, e.g. "orders:pyarrow,countries:csv"
+TABLE_PARSER_ENGINES = dict(
+    (item.split(":", 1)[0].strip(), item.split(":", 1)[1].strip().lower())
+    for item in os.getenv("TABLE_PARSER_ENGINES", "").split(",") if ":" in item
+)
 
 # Class to collect execution results
 class ImportResult:
@@ -40,6 +96,11 @@ class ImportResult:
         self.end_time = None
         self.downloaded_files = []
         self.processed_files = []
+        self.skipped_files = []
+        self.failed_files = []
+        self.file_encodings = {}
+        self.parse_stats = {}
+        self.transfer_stats = {}
         self.status = "running"
         self.errors = []
         self.log_messages = []
@@ -58,6 +119,44 @@ class ImportResult:
         else:
             logger.info(message)
     
+    def record_parse(self, engine, rows, nbytes, seconds):
+        """Add parsed rows, bytes and parse time to the totals of a parser engine"""
+        stats = self.parse_stats.setdefault(engine, {"rows": 0, "bytes": 0, "seconds": 0.0})
+        stats["rows"] += rows
+        stats["bytes"] += nbytes
+        stats["seconds"] += seconds
+    
+    def record_transfer(self, file_name, nbytes, seconds):
+        """Remember how long a file took to transfer from the SFTP server"""
+        self.transfer_stats[file_name] = {"bytes": nbytes, "seconds": seconds}
+    
+    def transfer_rates(self):
+        """Megabytes transferred per second for each file"""
+        rates = {}
+        for file_name, stats in self.transfer_stats.items():
+            megabytes = stats["bytes"] / (1024 * 1024)
+            rates[file_name] = {
+                "megabytes": round(megabytes, 3),
+                "seconds": round(stats["seconds"], 3),
+                "mb_per_second": round(megabytes / stats["seconds"], 3) if stats["seconds"] else None
+            }
+        return rates
+    
+    def parse_throughput(self):
+        """Rows and megabytes parsed per second by each parser engine"""
+        throughput = {}
+        for engine, stats in self.parse_stats.items():
+            seconds = stats["seconds"]
+            megabytes = stats["bytes"] / (1024 * 1024)
+            throughput[engine] = {
+                "rows": stats["rows"],
+                "megabytes": round(megabytes, 3),
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(stats["rows"] / seconds, 1) if seconds else None,
+                "mb_per_second": round(megabytes / seconds, 3) if seconds else None
+            }
+        return throughput
+    
     def complete(self, success=True):
         """Mark the import as complete"""
         self.end_time = datetime.now()
@@ -76,178 +175,1684 @@ class ImportResult:
             "duration_seconds": duration,
             "downloaded_files": self.downloaded_files,
             "processed_files": self.processed_files,
+            "skipped_files": self.skipped_files,
+            "failed_files": self.failed_files,
             "errors": self.errors,
             "row_counts": {file: count for file, count in self.processed_files},
+            "parse_throughput": self.parse_throughput(),
+            "transfer_rates": self.transfer_rates(),
             "log_messages": self.log_messages[-100:] if len(self.log_messages) > 100 else self.log_messages
         }
 
+# Class to remember which remote files earlier runs imported
+class ImportManifest:
+    def __init__(self, pool, entries, force=False):
+        self.pool = pool
+        self.entries = entries
+        self.force = force
+        self.remote = {}
+        self.loading = set()
+    
+    @classmethod
+    async def load(cls, pool, result, force=False):
+        """Read the manifest control table, creating it if needed"""
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS "{MANIFEST_TABLE}" (
+                        file_name text PRIMARY KEY,
+                        table_name text NOT NULL,
+                        size bigint NOT NULL,
+                        mtime bigint NOT NULL,
+                        content_hash text NOT NULL,
+                        encoding text,
+                        imported_at timestamptz NOT NULL DEFAULT now()
+                    )
+                """)
+                await conn.execute(f'ALTER TABLE "{MANIFEST_TABLE}" ADD COLUMN IF NOT EXISTS encoding text')
+                rows = await conn.fetch(f'SELECT * FROM "{MANIFEST_TABLE}"')
+        except Exception as e:
+            result.log("WARNING", f"Could not load import manifest, importing all files: {e}")
+            return None
+        
+        return cls(pool, {row['file_name']: row for row in rows}, force)
+    
+    def select(self, entries, dependencies, result):
+        """Return the names of the listed files that need downloading"""
+        self.remote = {entry.filename: entry.attrs for entry in entries}
+        tables = {table_for(entry.filename): entry.filename for entry in entries}
+        
+        changed = set()
+        for table_name, file_name in tables.items():
+            attrs = self.remote[file_name]
+            known = self.entries.get(file_name)
+            if (self.force or known is None or known['table_name'] != table_name
+                    or known['size'] != attrs.size or known['mtime'] != attrs.mtime):
+                changed.add(table_name)
+        
+        # Reloading a table truncates the tables that reference it, so those are reloaded too
+        while extra := {t for t in tables.keys() - changed
+                        if any(truncates(parent) for parent in dependencies.get(t, set()) & changed)}:
+            changed |= extra
+        
+        self.loading = changed
+        skipped = [file_name for table_name, file_name in tables.items() if table_name not in changed]
+        if skipped:
+            result.log("INFO", f"Skipping unchanged files: {skipped}")
+            result.skipped_files.extend(skipped)
+        return [file_name for table_name, file_name in tables.items() if table_name in changed]
+    
+    def content_unchanged(self, csv_file, table_name, content_hash, dependencies):
+        """Whether a changed listing entry still holds the content imported last time"""
+        known = self.entries.get(csv_file)
+        if self.force or known is None or known['table_name'] != table_name:
+            return False
+        # Skipping is only safe if no referenced table is being truncated
+        if any(truncates(parent) for parent in dependencies.get(table_name, set()) & self.loading):
+            return False
+        return known['content_hash'] == content_hash
+    
+    def encoding_hint(self, csv_file):
+        """Encoding detected when this file was last imported"""
+        known = self.entries.get(csv_file)
+        return known['encoding'] if known is not None else None
+    
+    async def invalidate(self, file_names, result):
+        """Mark the entries of files about to be reloaded as not matching any remote file
+        
+        Their tables are truncated before they are loaded again, so an entry is
+        only valid once record() has stored it after a successful import.
+        """
+        known = [file_name for file_name in file_names if file_name in self.entries]
+        if not known:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    f'UPDATE "{MANIFEST_TABLE}" SET size = -1, content_hash = '' WHERE file_name = ANY($1::text[])', known)
+        except Exception as e:
+            result.log("WARNING", f"Could not invalidate import manifest entries for {known}: {e}")
+    
+    async def record(self, csv_file, table_name, content_hash, result):
+        """Store the file's remote size, mtime and content hash after it was imported"""
+        attrs = self.remote[csv_file]
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(f"""
+                    INSERT INTO "{MANIFEST_TABLE}"
+                        (file_name, table_name, size, mtime, content_hash, encoding, imported_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, now())
+                    ON CONFLICT (file_name) DO UPDATE SET
+                        table_name = EXCLUDED.table_name, size = EXCLUDED.size, mtime = EXCLUDED.mtime,
+                        content_hash = EXCLUDED.content_hash,
+                        encoding = coalesce(EXCLUDED.encoding, "{MANIFEST_TABLE}".encoding),
+                        imported_at = EXCLUDED.imported_at
+                """, csv_file, table_name, attrs.size, attrs.mtime, content_hash,
+                    result.file_encodings.get(csv_file))
+        except Exception as e:
+            result.log("WARNING", f"Could not update import manifest for {csv_file}: {e}")
+
+def truncates(table_name):
+    """Whether loading table_name truncates it, emptying the tables that reference it
+
+    Merges leave the table in place, except for tables without a primary key.
+    """
+    if LOAD_STRATEGY != "merge":
+        return True
+    table = schema_cache.tables.get(table_name)
+    return table is None or not table["primary_key"]
+
+def file_hash(filepath, block_size=1024 * 1024):
+    """SHA-256 of a file, read in bounded blocks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Inputs are CSV files, optionally compressed, and zip archives of CSV files.
+# A member of an archive is named after both, e.g. "daily.zip/orders.csv".
+INPUT_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst', '.zip')
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+def split_member(name):
+    """Split an input name into the remote file and the zip member it names, if any"""
+    archive, separator, member = name.partition('.zip/')
+    if not separator:
+        return name, None
+    return archive + '.zip', member
+
+def table_for(name):
+    """Table an input is loaded into: its CSV file name without extensions"""
+    remote_file, member = split_member(name)
+    base = os.path.basename(member or remote_file)
+    for suffix in COMPRESSED_SUFFIXES:
+        base = base.removesuffix(suffix)
+    return os.path.splitext(base)[0]
+
+def is_plain_csv(name):
+    """Whether an input is an uncompressed CSV file, which can be read in byte ranges"""
+    return name.endswith('.csv') and split_member(name)[1] is None
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading .zst files requires the zstandard package") from None
+    return zstandard
+
+def head_decompressor(name):
+    """Function decompressing successive blocks from the start of input name"""
+    if name.endswith('.gz'):
+        return zlib.decompressobj(wbits=31).decompress
+    if name.endswith('.zst'):
+        return import_zstandard().ZstdDecompressor().decompressobj().decompress
+    return bytes
+
+def zip_members(raw):
+    """CSV members of the zip archive in a seekable binary stream"""
+    with zipfile.ZipFile(raw) as archive:
+        return [info for info in archive.infolist()
+                if not info.is_dir() and info.filename.endswith('.csv')]
+
+def zip_member_info(raw, member):
+    with zipfile.ZipFile(raw) as archive:
+        return archive.getinfo(member)
+
+def member_hash(info):
+    """Content hash of a zip member, taken from the archive's directory instead of its data"""
+    return f"crc32:{info.CRC:08x}:{info.file_size}"
+
+# Class closing a decompressing stream together with the stream it reads from
+class DecompressedStream(io.RawIOBase):
+    def __init__(self, stream, raw):
+        super().__init__()
+        self.stream = stream
+        self.raw = raw
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+    
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            self.raw.close()
+        super().close()
+
+def open_decompressed(raw, name):
+    """Binary stream of the CSV bytes of input name, read from its raw file stream
+    
+    Data is decompressed as it is read, so the uncompressed file is never
+    written anywhere. raw must be seekable for a zip member.
+    """
+    remote_file, member = split_member(name)
+    if member is not None:
+        # The member stays readable after the archive is closed
+        with zipfile.ZipFile(raw) as archive:
+            stream = archive.open(member)
+    elif name.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=raw, mode='rb')
+    elif name.endswith('.zst'):
+        stream = import_zstandard().ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True, closefd=False)
+    else:
+        return raw
+    return io.BufferedReader(DecompressedStream(stream, raw), buffer_size=STREAM_BLOCK_SIZE)
+
+def read_start(open_stream, size):
+    with open_stream() as f:
+        return f.read(size)
+
+# Class giving the loaders a CSV input from the download directory
+class LocalCSVSource:
+    def __init__(self, filepath, name=None):
+        self.file = filepath
+        self.name = name or os.path.basename(filepath)
+        # Only plain CSV files are split into byte ranges
+        self.path = filepath if is_plain_csv(self.name) else None
+        member = split_member(self.name)[1]
+        self.info = zip_member_info(filepath, member) if member is not None else None
+        self.size = self.info.file_size if self.info is not None else os.path.getsize(filepath)
+        # Downloaded files were timed by download_files
+        self.transfer = None
+    
+    def open(self):
+        """Open a blocking binary stream over the whole file"""
+        return open_decompressed(open(self.file, 'rb'), self.name)
+    
+    async def read_head(self, size):
+        return await asyncio.to_thread(read_start, self.open, size)
+    
+    async def content_hash(self):
+        if self.info is not None:
+            return member_hash(self.info)
+        return await asyncio.to_thread(file_hash, self.file)
+
+# Class giving the loaders a CSV input read straight from the SFTP server
+class SFTPCSVSource:
+    def __init__(self, remote, name, size, loop, info=None):
+        self.path = None
+        self.remote = remote
+        self.remote_size = size
+        self.name = name
+        self.info = info
+        self.size = info.file_size if info is not None else size
+        self.loop = loop
+        # Other files are hashed while they stream
+        self.hash = member_hash(info) if info is not None else None
+        self.transfer = None
+    
+    def open(self):
+        """Open a blocking binary stream over the whole file, for worker threads"""
+        if self.info is not None:
+            # Zip members are found through the archive's directory at its end
+            raw = io.BufferedReader(SFTPRandomAccess(self.remote, self.remote_size, self.loop),
+                                    buffer_size=STREAM_BLOCK_SIZE)
+        else:
+            raw = io.BufferedReader(SFTPStream(self), buffer_size=STREAM_BLOCK_SIZE)
+        return open_decompressed(raw, self.name)
+    
+    async def read_head(self, size):
+        if self.info is not None:
+            return await asyncio.to_thread(read_start, self.open, size)
+        return head_decompressor(self.name)(await self.remote.read(size, 0))
+    
+    async def content_hash(self):
+        # Known once a stream has read the whole file
+        return self.hash
+
+# Class giving worker threads seekable access to a remote file, for zip archives
+class SFTPRandomAccess(io.RawIOBase):
+    def __init__(self, remote, size, loop):
+        super().__init__()
+        self.remote = remote
+        self.size = size
+        self.loop = loop
+        self.position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = base + offset
+        return self.position
+    
+    def tell(self):
+        return self.position
+    
+    def readinto(self, buffer):
+        # Must not run on the event loop thread
+        block = asyncio.run_coroutine_threadsafe(
+            self.remote.read(len(buffer), self.position), self.loop).result()
+        buffer[:len(block)] = block
+        self.position += len(block)
+        return len(block)
+
+# Class reading a remote file for worker threads through a bounded read-ahead buffer
+class SFTPStream(io.RawIOBase):
+    def __init__(self, source):
+        super().__init__()
+        self.loop = source.loop
+        self.blocks = asyncio.Queue(maxsize=max(1, STREAM_BUFFER_MB * 1024 * 1024 // STREAM_BLOCK_SIZE))
+        self.pending = memoryview(b'')
+        self.finished = False
+        self.reader = asyncio.run_coroutine_threadsafe(self.read_ahead(source), self.loop)
+    
+    async def read_ahead(self, source):
+        """Fetch blocks on the event loop, hashing the file as it passes"""
+        digest = hashlib.sha256()
+        offset = 0
+        started = time.perf_counter()
+        try:
+            while block := await source.remote.read(STREAM_BLOCK_SIZE, offset):
+                offset += len(block)
+                digest.update(block)
+                await self.blocks.put(block)
+            source.hash = digest.hexdigest()
+            source.transfer = (offset, time.perf_counter() - started)
+            await self.blocks.put(b'')
+        except asyncio.CancelledError:
+            # Wake a thread still waiting for the next block
+            while not self.blocks.empty():
+                self.blocks.get_nowait()
+            self.blocks.put_nowait(OSError("Stream closed"))
+            raise
+        except Exception as e:
+            await self.blocks.put(e)
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        # Must not run on the event loop thread, which fills the queue
+        if not self.pending:
+            if self.finished:
+                return 0
+            block = asyncio.run_coroutine_threadsafe(self.blocks.get(), self.loop).result()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.finished = True
+                return 0
+            self.pending = memoryview(block)
+        
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+    
+    def close(self):
+        self.reader.cancel()
+        super().close()
+
+@contextlib.asynccontextmanager
+async def open_local_source(download_dir, csv_file):
+    remote_file = split_member(csv_file)[0]
+    yield LocalCSVSource(os.path.join(download_dir, remote_file), csv_file)
+
+@contextlib.asynccontextmanager
+async def open_sftp_source(connections, csv_file):
+    remote_file, member = split_member(csv_file)
+    async with connections.sftp_client() as sftp:
+        await sftp.chdir(SFTP_PATH)
+        attrs = await sftp.stat(remote_file)
+        async with sftp.open(remote_file, 'rb', block_size=SFTP_BLOCK_SIZE,
+                             max_requests=SFTP_MAX_REQUESTS) as remote:
+            loop = asyncio.get_running_loop()
+            info = None
+            if member is not None:
+                archive = io.BufferedReader(SFTPRandomAccess(remote, attrs.size, loop),
+                                            buffer_size=STREAM_BLOCK_SIZE)
+                info = await asyncio.to_thread(zip_member_info, archive, member)
+            yield SFTPCSVSource(remote, csv_file, attrs.size, loop, info)
+
+async def list_archive(sftp, entry):
+    """Listing entries for the CSV members of a remote zip archive
+    
+    Members are listed under the archive's modification time, so they count
+    as changed whenever the archive is; their content hash then tells
+    whether they were imported before.
+    """
+    async with sftp.open(entry.filename, 'rb', block_size=SFTP_BLOCK_SIZE,
+                         max_requests=SFTP_MAX_REQUESTS) as remote:
+        archive = io.BufferedReader(SFTPRandomAccess(remote, entry.attrs.size, asyncio.get_running_loop()),
+                                    buffer_size=STREAM_BLOCK_SIZE)
+        members = await asyncio.to_thread(zip_members, archive)
+    return [types.SimpleNamespace(filename=f"{entry.filename}/{info.filename}",
+                                  attrs=types.SimpleNamespace(size=info.file_size, mtime=entry.attrs.mtime))
+            for info in members]
+
+# Class to own the PostgreSQL pool and SFTP connection shared by all imports
+class ConnectionManager:
+    def __init__(self):
+        self.pool = None
+        # Transfers are spread over SFTP_CONNECTIONS SSH connections
+        self.ssh = [None] * max(1, SFTP_CONNECTIONS)
+        self._next_ssh = 0
+        self._pool_lock = asyncio.Lock()
+        self._ssh_lock = asyncio.Lock()
+    
+    async def start(self):
+        """Open both connections up front; failures are retried on first use"""
+        try:
+            await self.get_pool()
+        except Exception as e:
+            logger.warning(f"Could not create database pool at startup: {e}")
+        try:
+            await self.get_ssh()
+        except Exception as e:
+            logger.warning(f"Could not connect to SFTP server at startup: {e}")
+    
+    async def get_pool(self):
+        """Return the asyncpg pool, creating it on first use"""
+        async with self._pool_lock:
+            if self.pool is None:
+                logger.info("Creating database connection pool...")
+                self.pool = await asyncpg.create_pool(
+                    PG_CONN_STRING, min_size=PG_POOL_MIN_SIZE, max_size=PG_POOL_MAX_SIZE)
+            return self.pool
+    
+    async def get_ssh(self, reconnect=False, index=0):
+        """Return an SSH connection, opening a new one if there is none or reconnect is set"""
+        async with self._ssh_lock:
+            if reconnect and self.ssh[index] is not None:
+                self.ssh[index].close()
+                self.ssh[index] = None
+            if self.ssh[index] is None:
+                logger.info(f"Connecting to SFTP server {SFTP_HOST}...")
+                self.ssh[index] = await asyncssh.connect(
+                    SFTP_HOST, 
+                    username=SFTP_USER, 
+                    password=SFTP_PASS,
+                    known_hosts=None,
+                    keepalive_interval=SFTP_KEEPALIVE_INTERVAL
+                )
+            return self.ssh[index]
+    
+    @contextlib.asynccontextmanager
+    async def sftp_client(self):
+        """Open an SFTP session on the next shared connection, reconnecting once if it dropped"""
+        index = self._next_ssh
+        self._next_ssh = (index + 1) % len(self.ssh)
+        try:
+            sftp = await (await self.get_ssh(index=index)).start_sftp_client()
+        except (asyncssh.Error, OSError) as e:
+            logger.warning(f"SFTP connection lost ({e}), reconnecting...")
+            sftp = await (await self.get_ssh(reconnect=True, index=index)).start_sftp_client()
+        
+        try:
+            yield sftp
+        finally:
+            sftp.exit()
+            await sftp.wait_closed()
+    
+    async def health(self):
+        """Check both connections, returning a status string for each"""
+        status = {}
+        try:
+            pool = await self.get_pool()
+            await pool.fetchval('SELECT 1')
+            status["database"] = "ok"
+        except Exception as e:
+            status["database"] = f"error: {e}"
+        try:
+            async with self.sftp_client() as sftp:
+                await sftp.realpath('.')
+            status["sftp"] = "ok"
+        except Exception as e:
+            status["sftp"] = f"error: {e}"
+        return status
+    
+    async def close(self):
+        if self.pool is not None:
+            # Close the connection pool
+            await self.pool.close()
+            self.pool = None
+        for index, ssh in enumerate(self.ssh):
+            if ssh is not None:
+                ssh.close()
+                await ssh.wait_closed()
+                self.ssh[index] = None
+
+async def download_ranges(connections, file, part_path, meta_path, meta, read_size=8 * 1024 * 1024):
+    """Download one large file as concurrent ranged reads, each on its own SFTP session
+    
+    meta["ranges"] holds the next offset and the end of each range. They are
+    advanced as blocks are written and saved to meta_path, so an interrupted
+    download resumes every range where it stopped.
+    """
+    size = meta["size"]
+    
+    async def fetch(span):
+        async with connections.sftp_client() as sftp:
+            await sftp.chdir(SFTP_PATH)
+            async with sftp.open(file, 'rb', block_size=SFTP_BLOCK_SIZE,
+                                 max_requests=SFTP_MAX_REQUESTS) as remote:
+                with open(part_path, 'r+b') as local:
+                    local.seek(span[0])
+                    while span[0] < span[1]:
+                        block = await remote.read(min(read_size, span[1] - span[0]), span[0])
+                        if not block:
+                            raise EOFError(f"{file} is shorter than the {size} bytes listed")
+                        local.write(block)
+                        # The data must be on disk before the sidecar says so
+                        local.flush()
+                        span[0] += len(block)
+                        save_partial(meta_path, meta)
+    
+    await run_stages(*(fetch(span) for span in meta["ranges"] if span[0] < span[1]))
+
+def lock_file(f):
+    """Take an exclusive lock on an open file without waiting; False if it is held elsewhere
+    
+    The operating system releases the lock when the file is closed or its
+    process dies, so locks are never left behind by a killed job.
+    """
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+def create_job_dir(parent, result):
+    """Create a download directory of this job in parent, locked for as long as the job runs
+    
+    Directories of jobs that died are removed first; their lock is free.
+    Returns the directory and its open lock file, to be closed once the
+    directory is removed.
+    """
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if not name.startswith('job-') or not os.path.exists(os.path.join(path, '.lock')):
+            continue
+        with open(os.path.join(path, '.lock'), 'a') as lock:
+            if lock_file(lock):
+                result.log("INFO", f"Removing {name}, left behind by an interrupted job")
+                try:
+                    remove_dir(path, keep=lock.name)
+                except OSError as e:
+                    result.log("WARNING", f"Could not remove {name}: {e}")
+    
+    while True:
+        path = tempfile.mkdtemp(prefix='job-', dir=parent)
+        lock = open(os.path.join(path, '.lock'), 'a')
+        # Lost to a job cleaning up in between; take another directory
+        if lock_file(lock):
+            return path, lock
+        lock.close()
+
+def remove_dir(path, keep=None):
+    """Delete a directory tree, leaving the file keep (an open lock) until last"""
+    for root, dirs, files in os.walk(path, topdown=False):
+        for f in files:
+            if os.path.join(root, f) != keep:
+                os.unlink(os.path.join(root, f))
+        for d in dirs:
+            os.rmdir(os.path.join(root, d))
+    if keep is not None:
+        os.unlink(keep)
+    os.rmdir(path)
+
+def partial_paths(local_path):
+    """Paths of the partial download of local_path and of the remote attributes it was taken from"""
+    return local_path + '.part', local_path + '.part.json'
+
+def save_partial(meta_path, meta):
+    """Replace the sidecar of a partial download, so it is never left half written"""
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def resume_offset(local_path, attrs):
+    """Bytes of an earlier partial download of local_path that can be kept
+    
+    The partial file is only resumed if the remote file still has the size and
+    modification time it was downloaded from; otherwise it starts over.
+    """
+    part_path, meta_path = partial_paths(local_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta != {"size": attrs.size, "mtime": attrs.mtime, "ranged": False}:
+            return 0
+        return min(os.path.getsize(part_path), attrs.size)
+    except (OSError, ValueError):
+        return 0
+
+def resume_ranges(local_path, attrs):
+    """Ranges left of an earlier split download of local_path, as [next offset, end] pairs
+    
+    As with resume_offset, they are only kept if the remote file is unchanged;
+    otherwise None is returned and the download starts over.
+    """
+    part_path, meta_path = partial_paths(local_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta["size"], meta["mtime"], meta["ranged"]) != (attrs.size, attrs.mtime, True):
+            return None
+        if os.path.getsize(part_path) != attrs.size:
+            return None
+        return meta["ranges"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+async def fetch_from(connections, file, part_path, offset, size, read_size=8 * 1024 * 1024):
+    """Append the remote file to part_path, starting at offset"""
+    async with connections.sftp_client() as sftp:
+        await sftp.chdir(SFTP_PATH)
+        async with sftp.open(file, 'rb', block_size=SFTP_BLOCK_SIZE,
+                             max_requests=SFTP_MAX_REQUESTS) as remote:
+            with open(part_path, 'r+b' if offset else 'wb') as local:
+                local.seek(offset)
+                local.truncate()
+                while offset < size:
+                    block = await remote.read(min(read_size, size - offset), offset)
+                    if not block:
+                        raise EOFError(f"{file} is shorter than the {size} bytes listed")
+                    local.write(block)
+                    offset += len(block)
+
+async def read_checksum(sftp, file):
+    """Expected SHA-256 of file from its sha256sum-style sidecar"""
+    async with sftp.open(f"{file}.sha256", 'rb') as f:
+        content = (await f.read()).decode('ascii', errors='replace')
+    return content.split()[0].lower() if content.split() else None
+
+async def download_file(connections, file, local_path, attrs, result, checksum=None, partial_dir=None):
+    """Download file to local_path, resuming after interruptions
+    
+    The data goes to a partial file, with the remote size and modification
+    time saved alongside it, and for split downloads the progress of each
+    range. Transfer errors are retried with exponential backoff, resuming
+    from what was already written. The file is only moved to local_path once
+    its size, and its checksum if one is given, match the remote file.
+    Returns the number of bytes transferred.
+    
+    The partial file is kept in partial_dir, where later runs resume it, if
+    no other job holds its lock; otherwise, or without partial_dir, it is
+    written next to local_path.
+    """
+    if partial_dir is None:
+        return await download_partial(connections, file, local_path, local_path, attrs, result, checksum)
+    
+    with open(os.path.join(partial_dir, file) + '.part.lock', 'a') as lock:
+        if lock_file(lock):
+            partial_base = os.path.join(partial_dir, file)
+        else:
+            result.log("INFO", f"Another job is downloading {file}, downloading a copy of its own")
+            partial_base = local_path
+        return await download_partial(connections, file, partial_base, local_path, attrs, result, checksum)
+
+async def download_partial(connections, file, partial_base, local_path, attrs, result, checksum):
+    """Download file through the partial file of partial_base, then move it to local_path"""
+    part_path, meta_path = partial_paths(partial_base)
+    size = attrs.size
+    ranged = SFTP_SPLIT_PARTS > 1 and size >= SFTP_SPLIT_THRESHOLD_MB * 1024 * 1024
+    meta = {"size": size, "mtime": attrs.mtime, "ranged": ranged}
+    if ranged:
+        meta["ranges"] = resume_ranges(partial_base, attrs)
+        offset = size - sum(end - start for start, end in meta["ranges"]) if meta["ranges"] else 0
+    else:
+        offset = resume_offset(partial_base, attrs)
+    resumed_at = offset
+    if offset:
+        result.log("INFO", f"Resuming {file} from {offset} of {size} bytes")
+    else:
+        if ranged:
+            range_size = -(-size // SFTP_SPLIT_PARTS)
+            meta["ranges"] = [[start, min(start + range_size, size)] for start in range(0, size, range_size)]
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+        save_partial(meta_path, meta)
+    
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            if ranged:
+                await download_ranges(connections, file, part_path, meta_path, meta)
+            else:
+                await fetch_from(connections, file, part_path, offset, size)
+            break
+        except (asyncssh.Error, OSError, EOFError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            if ranged:
+                offset = size - sum(end - start for start, end in meta["ranges"])
+            elif os.path.exists(part_path):
+                offset = os.path.getsize(part_path)
+            delay = DOWNLOAD_RETRY_DELAY * 2 ** attempt
+            result.log("WARNING", f"Download of {file} interrupted at {offset} bytes ({e}), "
+                                  f"retrying in {delay:g}s")
+            await asyncio.sleep(delay)
+    
+    received = os.path.getsize(part_path)
+    if received != size:
+        raise ValueError(f"received {received} of {size} bytes")
+    if checksum is not None:
+        actual = await asyncio.to_thread(file_hash, part_path)
+        if actual != checksum:
+            # A corrupt partial file must not be resumed next time
+            os.unlink(part_path)
+            os.unlink(meta_path)
+            raise ValueError(f"SHA-256 {actual} does not match {checksum}")
+    os.replace(part_path, local_path)
+    os.unlink(meta_path)
+    return size - resumed_at
+
+# Queued for an input that will not be downloaded, so the tables that reference
+# its table stop waiting for it
+class DroppedFile:
+    def __init__(self, name):
+        self.name = name
+
+# Class capping the files that are downloading or waiting for their import
+class FileSlots:
+    """A remote file holds a slot from the start of its download until every
+    input read from it is imported, when its local copy is deleted.
+
+    Slots are taken in table load order, so a file never waits for a slot
+    held by a file whose import waits for it.
+    """
+    def __init__(self, limit, dependencies, download_dir=None):
+        self.semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.dependencies = dependencies
+        self.download_dir = download_dir
+        self.pending = {}
+    
+    def order(self, remote_files, result):
+        """Remote files, given with their input names, in the order they take slots"""
+        tables = {table_for(name): remote_file
+                  for remote_file, names in remote_files.items() for name in names}
+        graph = {
+            remote_file: {tables[parent] for name in names
+                          for parent in self.dependencies.get(table_for(name), ())
+                          if parent in tables and tables[parent] != remote_file}
+            for remote_file, names in remote_files.items()
+        }
+        try:
+            return list(graphlib.TopologicalSorter(graph).static_order())
+        except graphlib.CycleError:
+            # Archives holding tables that reference each other cannot be
+            # downloaded one at a time
+            if self.semaphore is not None:
+                result.log("WARNING", "Archives reference each other's tables, not limiting files in flight")
+                self.semaphore = None
+            return list(remote_files)
+    
+    async def acquire(self, remote_file, names):
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+        self.pending[remote_file] = set(names)
+    
+    def release(self, name):
+        """Mark an input as done, freeing its file's slot after the last one"""
+        remote_file = split_member(name)[0]
+        names = self.pending.get(remote_file)
+        if names is None:
+            return
+        names.discard(name)
+        if names:
+            return
+        del self.pending[remote_file]
+        if self.download_dir is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(self.download_dir, remote_file))
+        if self.semaphore is not None:
+            self.semaphore.release()
+
 # Modified functions to use ImportResult for logging and tracking
-async def download_files(download_dir, result):
+async def download_files(download_dir, result, connections, downloaded=None, select=None, check=None,
+                         in_flight=None, partial_dir=None):
+    """Download the CSV files, putting each name on the downloaded queue as it completes
+
+    The select coroutine, if given, receives the listed SFTP entries and
+    returns the names of the files to download. Members of zip archives are
+    listed as separate entries named "<archive>/<member>", and an archive is
+    downloaded once for all of its selected members. The check coroutine, if
+    given, receives each file name and the first bytes of the (decompressed)
+    file, and the file is only downloaded if it returns True. A file that
+    cannot be downloaded is marked failed without stopping the others, and
+    a file rejected by check or failing is queued as a DroppedFile.
+    Downloads start in table load order once in_flight, a FileSlots, has
+    room for them; the consumer of the queue releases each name once
+    imported. Partial downloads are kept in partial_dir, if given, to be
+    resumed by later runs. Returns None if the files cannot be listed.
+    """
+    if in_flight is None:
+        in_flight = FileSlots(0, {})
     result.log("INFO", f"Downloading files from SFTP server {SFTP_HOST}...")
     
     try:
-        # Connect to SFTP server
-        async with asyncssh.connect(
-            SFTP_HOST, 
-            username=SFTP_USER, 
-            password=SFTP_PASS,
-            known_hosts=None
-        ) as conn:
-            async with conn.start_sftp_client() as sftp:
-                # Change to the remote directory
-                await sftp.chdir(SFTP_PATH)
-                
-                # Get list of CSV files
-                files = [f for f in await sftp.listdir() if f.endswith('.csv')]
-                
-                if len(files) != 3:
-                    result.log("WARNING", f"Expected exactly 3 files, but found {len(files)}")
-                
-                result.log("INFO", f"Found files: {files}")
-                
-                # Download files concurrently
-                download_tasks = []
-                for file in files:
-                    local_path = os.path.join(download_dir, file)
-                    download_tasks.append(sftp.get(file, local_path))
-                
-                # Wait for all downloads to complete
-                await asyncio.gather(*download_tasks)
-                
-                result.log("INFO", f"Successfully downloaded {len(files)} files")
-                result.downloaded_files = files
-                return files
+        # Open an SFTP session on the shared connection
+        async with connections.sftp_client() as sftp:
+            # Change to the remote directory
+            await sftp.chdir(SFTP_PATH)
+            
+            # Get list of CSV files, looking inside zip archives
+            listing = await sftp.readdir()
+            entries = []
+            for entry in listing:
+                if entry.filename.endswith('.zip'):
+                    try:
+                        entries.extend(await list_archive(sftp, entry))
+                    except (asyncssh.Error, OSError, zipfile.BadZipFile) as e:
+                        result.log("ERROR", f"Could not read archive {entry.filename}: {e}")
+                        result.failed_files.append(entry.filename)
+                elif entry.filename.endswith(INPUT_SUFFIXES):
+                    entries.append(entry)
+            files = [e.filename for e in entries]
+            attrs = {e.filename: e.attrs for e in listing}
+            checksums = {e.filename for e in listing if e.filename.endswith('.sha256')}
+            
+            if len(files) != 3:
+                result.log("WARNING", f"Expected exactly 3 files, but found {len(files)}")
+            
+            result.log("INFO", f"Found files: {files}")
+            if select is not None:
+                files = await select(entries)
+            
+            # Each remote file is downloaded once, for all of its selected members
+            remote_files = collections.defaultdict(list)
+            for file in files:
+                remote_files[split_member(file)[0]].append(file)
+            
+            async def download(remote_file, names):
+                queued = set()
+                try:
+                    if check is not None:
+                        names = [name for name in names
+                                 if await check(name, await read_remote_header(sftp, name))]
+                        if not names:
+                            return
+                    if STREAM_FROM_SFTP:
+                        # The file is read from the server while it is imported
+                        result.log("INFO", f"Streaming {', '.join(names)} from the server")
+                    else:
+                        checksum = None
+                        if VERIFY_CHECKSUMS and f"{remote_file}.sha256" in checksums:
+                            checksum = await read_checksum(sftp, remote_file)
+                        started = time.perf_counter()
+                        transferred = await download_file(connections, remote_file,
+                                                          os.path.join(download_dir, remote_file),
+                                                          attrs[remote_file], result, checksum, partial_dir)
+                        result.record_transfer(remote_file, transferred, time.perf_counter() - started)
+                        rate = result.transfer_rates()[remote_file]["mb_per_second"] or 0
+                        verified = ", checksum verified" if checksum else ""
+                        result.log("INFO", f"Downloaded {remote_file} ({rate:.1f} MB/s{verified})")
+                    for name in names:
+                        result.downloaded_files.append(name)
+                        if downloaded is not None:
+                            await downloaded.put(name)
+                        queued.add(name)
+                except (asyncssh.Error, OSError, EOFError, ValueError, zipfile.BadZipFile) as e:
+                    result.log("ERROR", f"Could not download {remote_file}: {e}")
+                    result.failed_files.extend(names)
+                finally:
+                    # Inputs that will not be imported give back their share of the slot
+                    for name in remote_files[remote_file]:
+                        if name not in queued:
+                            in_flight.release(name)
+                            if downloaded is not None:
+                                await downloaded.put(DroppedFile(name))
+            
+            # Start each download once a slot is free, and wait for all of them
+            tasks = []
+            try:
+                for remote_file in in_flight.order(remote_files, result):
+                    await in_flight.acquire(remote_file, remote_files[remote_file])
+                    tasks.append(asyncio.ensure_future(download(remote_file, remote_files[remote_file])))
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            await run_stages(*tasks)
+            
+            result.log("INFO", f"Successfully downloaded {len(result.downloaded_files)} of {len(files)} files")
+            return files
     
     except Exception as e:
         result.log("ERROR", f"Error downloading files: {e}")
-        return []
+        return None
+    finally:
+        if downloaded is not None:
+            await downloaded.put(None)
+
+# Changes whenever DDL touches the table's columns, defaults or constraints. The
+# pg_class row itself is left out because every TRUNCATE rewrites it.
+TABLE_VERSION_SQL = """
+    c.oid::text
+    || ':' || (SELECT coalesce(string_agg(a.xmin::text, ',' ORDER BY a.attnum), '')
+               FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0)
+    || ':' || (SELECT coalesce(string_agg(d.xmin::text, ',' ORDER BY d.adnum), '')
+               FROM pg_attrdef d WHERE d.adrelid = c.oid)
+    || ':' || (SELECT coalesce(string_agg(k.xmin::text, ',' ORDER BY k.oid), '')
+               FROM pg_constraint k WHERE k.conrelid = c.oid)
+"""
+
+# Class caching table definitions from pg_catalog across import jobs
+class SchemaCache:
+    def __init__(self):
+        self.tables = {}
+    
+    async def refresh(self, conn, table_names, result):
+        """Make sure the cache holds a current definition of every table in table_names
+
+        Cached tables are checked with one cheap version query; only missing or
+        changed tables are fetched again, all in a single catalog query.
+        """
+        stale = [name for name in table_names if name not in self.tables]
+        cached = [name for name in table_names if name in self.tables]
+        
+        if cached:
+            versions = await conn.fetch(f"""
+                SELECT c.relname, {TABLE_VERSION_SQL} AS version
+                FROM pg_class c
+                WHERE c.relname = ANY($1::text[]) AND pg_table_is_visible(c.oid)
+                  AND c.relkind IN ('r', 'p')
+            """, cached)
+            current = {row['relname']: row['version'] for row in versions}
+            for name in cached:
+                # Concurrent imports share the cache, so entries may change across awaits
+                table = self.tables.get(name)
+                if table is None or current.get(name) != table["version"]:
+                    self.tables.pop(name, None)
+                    stale.append(name)
+        
+        if stale:
+            result.log("INFO", f"Fetching table definitions for {stale}")
+            await self.fetch(conn, stale)
+    
+    async def fetch(self, conn, table_names):
+        rows = await conn.fetch(f"""
+            SELECT c.relname, {TABLE_VERSION_SQL} AS version,
+                   (SELECT json_agg(json_build_object(
+                               'name', a.attname,
+                               'type', format_type(coalesce(nullif(t.typbasetype, 0), a.atttypid), NULL),
+                               'not_null', a.attnotnull,
+                               'default', pg_get_expr(d.adbin, d.adrelid))
+                           ORDER BY a.attnum)
+                    FROM pg_attribute a
+                    JOIN pg_type t ON t.oid = a.atttypid
+                    LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+                    WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+                   (SELECT array_agg(a.attname ORDER BY array_position(x.indkey::int2[], a.attnum))
+                    FROM pg_index x
+                    JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+                    WHERE x.indrelid = c.oid AND x.indisprimary) AS primary_key,
+                   (SELECT array_agg(DISTINCT p.relname)
+                    FROM pg_constraint k
+                    JOIN pg_class p ON p.oid = k.confrelid
+                    WHERE k.conrelid = c.oid AND k.contype = 'f' AND p.oid <> c.oid) AS references
+            FROM pg_class c
+            WHERE c.relname = ANY($1::text[]) AND pg_table_is_visible(c.oid)
+              AND c.relkind IN ('r', 'p')
+        """, list(table_names))
+        
+        for row in rows:
+            self.tables[row['relname']] = {
+                "version": row['version'],
+                "columns": json.loads(row['columns'] or '[]'),
+                "primary_key": list(row['primary_key'] or []),
+                "references": set(row['references'] or []),
+            }
+    
+    async def get(self, conn, table_name, result):
+        """Return the cached definition of table_name, fetching it if needed"""
+        if table_name not in self.tables:
+            await self.refresh(conn, [table_name], result)
+        return self.tables.get(table_name)
+
+# Table definitions shared by all imports in this process
+schema_cache = SchemaCache()
 
 async def get_table_schema(conn, table_name, result):
     # Get column information
-    schema_query = """
-        SELECT column_name, data_type 
-        FROM information_schema.columns 
-        WHERE table_name = $1 
-        ORDER BY ordinal_position
-    """
-    
-    columns = await conn.fetch(schema_query, table_name)
+    table = await schema_cache.get(conn, table_name, result)
     
     # Convert to tuple format for compatibility
-    schema = [(col['column_name'], col['data_type']) for col in columns]
+    schema = [(col['name'], col['type']) for col in table["columns"]] if table else []
     
     result.log("INFO", f"Schema for {table_name}: {schema}")
     return schema
 
-async def process_dataframe(conn, df, table_name, schema, result):
-    # Prepare column lists
-    db_columns = [col[0] for col in schema]
+async def get_table_dependencies(conn, table_names, result):
+    """Map each table to the other target tables it references by foreign key"""
+    await schema_cache.refresh(conn, table_names, result)
     
-    # Match available columns from dataframe to database schema
-    matched_columns = []
-    for db_col in db_columns:
-        # Find a matching column in DataFrame (case insensitive)
-        match = None
-        for df_col in df.columns:
-            if df_col.lower() == db_col.lower():
-                match = df_col
-                break
+    dependencies = {}
+    for table in table_names:
+        info = schema_cache.tables.get(table)
+        dependencies[table] = info["references"] & set(table_names) if info else set()
+    
+    # A cycle cannot be ordered, so fall back to loading one table at a time
+    try:
+        order = list(graphlib.TopologicalSorter(dependencies).static_order())
+    except graphlib.CycleError as e:
+        result.log("WARNING", f"Foreign key cycle between tables {e.args[1]}, loading tables sequentially")
+        return {table: set(table_names[:i]) for i, table in enumerate(table_names)}
+    
+    result.log("INFO", f"Table load order: {order}")
+    return dependencies
+
+@contextlib.asynccontextmanager
+async def table_lock(table_name, result):
+    """Hold an advisory lock on table_name while it is loaded
+
+    Overlapping jobs would otherwise truncate the table under each other or
+    drop each other's staging table. The lock is taken on a connection of its
+    own, so jobs waiting for it do not hold pool connections the job loading
+    the table may need; closing that connection releases the lock.
+    """
+    conn = await asyncpg.connect(PG_CONN_STRING)
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", table_name):
+            result.log("INFO", f"Waiting for another import of {table_name} to finish...")
+            await conn.execute("SELECT pg_advisory_lock(hashtext($1))", table_name)
+        yield
+    finally:
+        await conn.close()
+
+def staging_name(name):
+    """Name used for the staging copy of a table, index or constraint"""
+    return f"{name[:47]}_import_staging"
+
+async def create_staging_table(conn, table_name, result):
+    """Create an UNLOGGED copy of table_name to load into, or None if it cannot be swapped
+
+    Tables referenced by foreign keys or views, or with triggers, row level
+    security or inheritance, keep the truncate strategy because a swap would
+    leave those objects pointing at the dropped table.
+    """
+    table = await conn.fetchrow("""
+        SELECT c.oid, n.nspname, pg_get_userbyid(c.relowner) AS owner,
+               c.relkind = 'r'
+               AND NOT c.relrowsecurity
+               AND NOT EXISTS (SELECT 1 FROM pg_constraint f
+                               WHERE f.confrelid = c.oid AND f.contype = 'f')
+               AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                               JOIN pg_rewrite r ON r.oid = d.objid
+                               WHERE d.classid = 'pg_rewrite'::regclass
+                                 AND d.refobjid = c.oid AND r.ev_class <> c.oid)
+               AND NOT EXISTS (SELECT 1 FROM pg_trigger t
+                               WHERE t.tgrelid = c.oid AND NOT t.tgisinternal)
+               AND NOT EXISTS (SELECT 1 FROM pg_inherits i
+                               WHERE i.inhrelid = c.oid OR i.inhparent = c.oid) AS swappable
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.oid = to_regclass(quote_ident($1))
+    """, table_name)
+    
+    if table is None or not table['swappable']:
+        result.log("INFO", f"Table {table_name} has dependent objects, using truncate strategy")
+        return None
+    
+    staging = {
+        "strategy": "swap",
+        "table": table_name,
+        "name": staging_name(table_name),
+        "oid": table['oid'],
+        "schema": table['nspname'],
+        "owner": table['owner'],
+    }
+    staging["qualified"] = f'"{staging["schema"]}"."{staging["name"]}"'
+    
+    result.log("INFO", f"Creating staging table {staging['name']} for {table_name}...")
+    await conn.execute(f'DROP TABLE IF EXISTS {staging["qualified"]}')
+    # Indexes and key constraints are built after the load, not maintained during it
+    await conn.execute(
+        f'CREATE UNLOGGED TABLE {staging["qualified"]} '
+        f'(LIKE "{staging["schema"]}"."{table_name}" INCLUDING ALL EXCLUDING INDEXES)'
+    )
+    return staging
+
+async def build_staging_table(conn, staging, result):
+    """Make the loaded staging table durable and give it the live table's keys, indexes and grants"""
+    name = staging["qualified"]
+    result.log("INFO", f"Building indexes on staging table {staging['name']}...")
+    await conn.execute(f'ALTER TABLE {name} SET LOGGED')
+    
+    # Key constraints build their own indexes; other indexes are recreated from their definitions
+    constraints = await conn.fetch("""
+        SELECT conname, pg_get_constraintdef(oid) AS definition
+        FROM pg_constraint
+        WHERE conrelid = $1 AND contype IN ('p', 'u', 'x', 'f')
+        ORDER BY contype = 'f', conname
+    """, staging["oid"])
+    for con in constraints:
+        await conn.execute(
+            f'ALTER TABLE {name} ADD CONSTRAINT "{staging_name(con["conname"])}" {con["definition"]}')
+    
+    indexes = await conn.fetch("""
+        SELECT i.relname, x.indisunique, pg_get_indexdef(x.indexrelid) AS definition
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = $1
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+    """, staging["oid"])
+    for index in indexes:
+        unique = "UNIQUE " if index["indisunique"] else ""
+        definition = index["definition"][index["definition"].index(" USING "):]
+        await conn.execute(
+            f'CREATE {unique}INDEX "{staging_name(index["relname"])}" ON {name}{definition}')
+    
+    # Carry over ownership and privileges granted on the live table
+    await conn.execute(f'ALTER TABLE {name} OWNER TO "{staging["owner"]}"')
+    grants = await conn.fetch("""
+        SELECT a.privilege_type, a.is_grantable,
+               CASE WHEN a.grantee = 0 THEN 'PUBLIC'
+                    ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = $1 AND a.grantee <> c.relowner
+    """, staging["oid"])
+    for grant in grants:
+        option = " WITH GRANT OPTION" if grant["is_grantable"] else ""
+        await conn.execute(f'GRANT {grant["privilege_type"]} ON {name} TO {grant["grantee"]}{option}')
+    
+    staging["constraints"] = [con["conname"] for con in constraints]
+    staging["indexes"] = [index["relname"] for index in indexes]
+
+async def swap_staging_table(conn, staging, result):
+    """Replace the live table with the loaded staging table in one short transaction"""
+    await build_staging_table(conn, staging, result)
+    
+    table_name, name, schema = staging["table"], staging["qualified"], staging["schema"]
+    result.log("INFO", f"Swapping {staging['name']} into {table_name}...")
+    
+    async with conn.transaction():
+        # Serial sequences belong to the live table's columns and would be dropped with it
+        sequences = await conn.fetch("""
+            SELECT d.objid::regclass::text AS sequence, a.attname
+            FROM pg_depend d
+            JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+            JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+            WHERE d.classid = 'pg_class'::regclass AND d.refobjid = $1 AND d.deptype = 'a'
+        """, staging["oid"])
+        for seq in sequences:
+            await conn.execute(f'ALTER SEQUENCE {seq["sequence"]} OWNED BY {name}."{seq["attname"]}"')
         
-        if match:
-            matched_columns.append((db_col, match))
+        await conn.execute(f'DROP TABLE "{schema}"."{table_name}"')
+        await conn.execute(f'ALTER TABLE {name} RENAME TO "{table_name}"')
+        for con in staging["constraints"]:
+            await conn.execute(
+                f'ALTER TABLE "{schema}"."{table_name}" RENAME CONSTRAINT "{staging_name(con)}" TO "{con}"')
+        for index in staging["indexes"]:
+            await conn.execute(f'ALTER INDEX "{schema}"."{staging_name(index)}" RENAME TO "{index}"')
+    
+    result.log("INFO", f"Swapped staging table into {table_name}")
+
+async def drop_staging_table(conn, staging, result):
+    try:
+        await conn.execute(f'DROP TABLE IF EXISTS {staging["qualified"]}')
+    except Exception as e:
+        result.log("WARNING", f"Could not drop staging table {staging['name']}: {e}")
+
+async def create_merge_table(conn, table_name, csv_columns, schema, result):
+    """Create an UNLOGGED table holding the file's columns, to be merged on the primary key
+
+    Returns None when the table has no primary key or the file shares no key
+    columns with it, in which case the truncate strategy is used instead. A
+    table referenced by others is not truncated for a file missing its key,
+    as the tables referencing it may have been skipped as unchanged; that
+    raises ValueError.
+    """
+    table = await schema_cache.get(conn, table_name, result)
+    primary_key = table["primary_key"] if table else []
+    matched_columns = match_columns(csv_columns, schema, result)
+    columns = [db_col for db_col, _ in matched_columns]
+    
+    if primary_key and not set(primary_key) <= set(columns):
+        if any(table_name in other["references"] for other in schema_cache.tables.values()):
+            raise ValueError(f"the file is missing key columns {primary_key} of {table_name}, "
+                             f"which other tables reference")
+    if not primary_key or not set(primary_key) <= set(columns):
+        result.log("WARNING", f"Table {table_name} has no primary key in the CSV, using truncate strategy")
+        return None
+    
+    nspname = await conn.fetchval("""
+        SELECT n.nspname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.oid = to_regclass(quote_ident($1))
+    """, table_name)
+    
+    staging = {
+        "strategy": "merge",
+        "table": table_name,
+        "name": staging_name(table_name),
+        "schema": nspname,
+        "primary_key": primary_key,
+        "columns": columns,
+    }
+    staging["qualified"] = f'"{nspname}"."{staging["name"]}"'
+    
+    result.log("INFO", f"Creating merge table {staging['name']} for {table_name} keyed on {primary_key}...")
+    cols_sql = ', '.join(f'"{col}"' for col in columns)
+    await conn.execute(f'DROP TABLE IF EXISTS {staging["qualified"]}')
+    await conn.execute(
+        f'CREATE UNLOGGED TABLE {staging["qualified"]} AS '
+        f'SELECT {cols_sql} FROM "{nspname}"."{table_name}" WITH NO DATA'
+    )
+    return staging
+
+async def merge_staging_table(conn, staging, result):
+    """Upsert changed rows from the merge table into the live table on its primary key"""
+    table = f'"{staging["schema"]}"."{staging["table"]}"'
+    name = staging["qualified"]
+    key_sql = ', '.join(f'"{col}"' for col in staging["primary_key"])
+    cols_sql = ', '.join(f'"{col}"' for col in staging["columns"])
+    
+    # loaded_at changes on every run, so it is written but not compared
+    updated = [col for col in staging["columns"] if col not in staging["primary_key"]]
+    compared = [col for col in updated if col != 'loaded_at']
+    
+    if updated:
+        set_sql = ', '.join(f'"{col}" = EXCLUDED."{col}"' for col in updated)
+        conflict_sql = f'DO UPDATE SET {set_sql}'
+        if compared:
+            old_sql = ', '.join(f'{table}."{col}"' for col in compared)
+            new_sql = ', '.join(f'EXCLUDED."{col}"' for col in compared)
+            conflict_sql += f' WHERE ({old_sql}) IS DISTINCT FROM ({new_sql})'
+    else:
+        conflict_sql = 'DO NOTHING'
+    
+    # The last occurrence of a key in the file wins; rows are written in file
+    # order, so that is the last one in the merge table
+    upsert_query = f"""
+        INSERT INTO {table} ({cols_sql})
+        SELECT DISTINCT ON ({key_sql}) {cols_sql} FROM {name}
+        ORDER BY {key_sql}, ctid DESC
+        ON CONFLICT ({key_sql}) {conflict_sql}
+    """
+    
+    result.log("INFO", f"Merging {staging['name']} into {staging['table']}...")
+    await conn.execute(f'ANALYZE {name}')
+    
+    async with conn.transaction():
+        status = await conn.execute(upsert_query)
+        result.log("INFO", f"Inserted or updated {status.split()[-1]} rows in {staging['table']}")
+        
+        if MERGE_DELETE_MISSING:
+            match_sql = ' AND '.join(f'm."{col}" = t."{col}"' for col in staging["primary_key"])
+            status = await conn.execute(
+                f'DELETE FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM {name} m WHERE {match_sql})')
+            result.log("INFO", f"Deleted {status.split()[-1]} rows missing from the file in {staging['table']}")
+
+# PostgreSQL type groups and the fixed formats used to parse text values
+INTEGER_TYPES = ('integer', 'bigint', 'smallint')
+NUMERIC_TYPES = ('numeric', 'decimal', 'real', 'double precision')
+TEXT_TYPES = ('text', 'character varying', 'character')
+BOOLEAN_VALUES = {'true': True, 't': True, 'yes': True, 'y': True, 'on': True, '1': True,
+                  'false': False, 'f': False, 'no': False, 'n': False, 'off': False, '0': False}
+DATE_FORMAT = '%Y-%m-%d'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def null_mask(series):
+    """Boolean mask of missing values, treating empty strings as NULL"""
+    mask = series.isna().to_numpy()
+    if series.dtype == object:
+        mask |= (series == '').to_numpy()
+    return mask
+
+def with_nulls(values, valid):
+    """Build an object array holding values where valid and None elsewhere"""
+    column = np.empty(len(valid), dtype=object)
+    column[valid] = values[valid]
+    return column
+
+def row_tuples(columns):
+    """Materialise converted (values, valid) columns as typed row tuples"""
+    return list(zip(*[with_nulls(values, valid).tolist() for values, valid in columns]))
+
+# Converters return a typed NumPy array of values and a mask of the valid (non-NULL) rows
+
+def convert_integer_text(text, missing):
+    """Parse integer text exactly, as int() does, without going through floats"""
+    text = text.str.strip()
+    valid = ~missing & text.str.fullmatch('[+-]?[0-9]+', na=False).to_numpy(dtype=bool)
+    numeric = pd.to_numeric(text.where(valid, '0'), errors='coerce', dtype_backend='numpy_nullable')
+    if numeric.dtype.kind == 'i':
+        return numeric.to_numpy(dtype='int64', na_value=0), valid
+    
+    # to_numeric only reads values outside the bigint range as floats;
+    # they become NULL like other unparseable values
+    parsed = np.array([int(value) if ok else 0 for value, ok in zip(text, valid)], dtype=object)
+    bounds = np.iinfo(np.int64)
+    valid &= ((parsed >= int(bounds.min)) & (parsed <= int(bounds.max))).astype(bool)
+    return np.where(valid, parsed, 0).astype(np.int64), valid
+
+def convert_integer_column(series, missing):
+    numeric = pd.to_numeric(series.mask(missing), errors='coerce', dtype_backend='numpy_nullable')
+    valid = ~missing & numeric.notna().to_numpy()
+    
+    # Text with a decimal or out of range value comes back as floats, which
+    # would change integers above 2**53, so it is parsed again exactly
+    if (numeric.dtype.kind == 'f' and series.dtype == object
+            and (series.map(type).to_numpy() == str)[~missing].all()):
+        return convert_integer_text(series.mask(missing), missing)
+    
+    # Values outside the bigint range become NULL like other unparseable values
+    if numeric.dtype.kind == 'f':
+        values = numeric.to_numpy(dtype='float64', na_value=np.nan)
+        valid &= np.isfinite(values) & (np.abs(values) < 2.0 ** 63)
+        # int() rejects text such as "1.5" but truncates real floats
+        if series.dtype == object:
+            valid &= values == np.trunc(values)
+        values = np.where(valid, np.trunc(values), 0).astype(np.int64)
+    elif numeric.dtype.kind == 'u':
+        values = numeric.to_numpy(dtype='uint64', na_value=0)
+        valid &= values <= np.iinfo(np.int64).max
+        values = np.where(valid, values, 0).astype(np.int64)
+    else:
+        values = numeric.to_numpy(dtype='int64', na_value=0)
+    
+    return values, valid
+
+def convert_numeric_column(series, missing):
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64')
+    valid = ~missing & ~np.isnan(values)
+    return values, valid
+
+def convert_datetime_column(series, missing, fmt, unit):
+    # Columns the reader already parsed only need their precision adjusted
+    if series.dtype.kind == 'M':
+        values = series.to_numpy(dtype=f'datetime64[{unit}]')
+        return values, ~missing & ~np.isnat(values)
+    
+    # Only text is parsed; values pandas already typed pass through unchanged
+    if series.dtype != object:
+        return series.to_numpy(dtype=object), ~missing
+    
+    is_text = series.map(type).to_numpy() == str
+    parsed = pd.to_datetime(series.where(is_text), format=fmt, errors='coerce')
+    values = parsed.to_numpy(dtype=f'datetime64[{unit}]')
+    valid = ~missing & ~np.isnat(values)
+    
+    passthrough = ~missing & ~is_text
+    if passthrough.any():
+        values = values.astype(object)
+        values[passthrough] = series.to_numpy(dtype=object)[passthrough]
+        valid |= passthrough
+    return values, valid
+
+def convert_boolean_column(series, missing):
+    # Engines reading text hand over 'true'/'f'/...; pandas may already have typed the column
+    if series.dtype == bool:
+        return series.to_numpy(), ~missing
+    values = series.astype(str).str.strip().str.lower().map(BOOLEAN_VALUES)
+    valid = ~missing & values.notna().to_numpy()
+    return values.eq(True).to_numpy(), valid
+
+def convert_text_column(series, missing):
+    # All other types (strings, etc.) are passed through as-is
+    return series.to_numpy(dtype=object), ~missing
+
+def column_converter(col_type):
+    """Pick the column conversion function for a PostgreSQL type"""
+    if col_type in INTEGER_TYPES:
+        return convert_integer_column
+    elif col_type in NUMERIC_TYPES:
+        return convert_numeric_column
+    elif col_type == 'date':
+        return functools.partial(convert_datetime_column, fmt=DATE_FORMAT, unit='D')
+    elif 'timestamp' in col_type:
+        return functools.partial(convert_datetime_column, fmt=TIMESTAMP_FORMAT, unit='us')
+    elif col_type == 'boolean':
+        return convert_boolean_column
+    return convert_text_column
+
+# Binary COPY layout of each fixed-width type; text types are sent as UTF-8
+BINARY_FORMATS = {
+    'smallint': '>i2', 'integer': '>i4', 'bigint': '>i8',
+    'real': '>f4', 'double precision': '>f8',
+    'date': '>i4', 'timestamp without time zone': '>i8', 'boolean': '>u1'
+}
+BINARY_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + bytes(8)
+BINARY_COPY_TRAILER = b'\xff\xff'
+PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+def binary_column_values(values, valid, col_type):
+    """Encode the valid values of a column as the bytes of each field
+
+    Returns a flat uint8 array of the field data and the data length of each
+    valid row. Raises OverflowError or TypeError for values that cannot be
+    encoded, so the caller can fall back to row tuples.
+    """
+    values = values[valid]
+    if col_type in TEXT_TYPES:
+        # join raises TypeError if any value is not a string
+        data = ''.join(values).encode('utf-8')
+        lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+        if len(data) != lengths.sum():
+            # Non-ASCII text: byte lengths differ from character lengths
+            lengths = np.fromiter((len(value.encode('utf-8')) for value in values),
+                                  dtype=np.int64, count=len(values))
+        return np.frombuffer(data, dtype=np.uint8), lengths
+    
+    fmt = np.dtype(BINARY_FORMATS[col_type])
+    if values.dtype == object:
+        raise TypeError(f"Column of type {col_type} holds untyped values")
+    if col_type == 'date':
+        values = (values.astype('datetime64[D]') - PG_EPOCH.astype('datetime64[D]')).astype(np.int64)
+    elif col_type == 'timestamp without time zone':
+        values = (values.astype('datetime64[us]') - PG_EPOCH).astype(np.int64)
+    if fmt.kind == 'i' and len(values):
+        limits = np.iinfo(fmt)
+        if values.min() < limits.min or values.max() > limits.max:
+            raise OverflowError(f"Value out of range for {col_type}")
+    
+    data = values.astype(fmt).view(np.uint8)
+    return data, np.full(len(values), fmt.itemsize, dtype=np.int64)
+
+def scatter(out, starts, data, lengths):
+    """Copy consecutive runs of data, of the given lengths, to out at starts"""
+    sources = np.cumsum(lengths) - lengths
+    out[np.repeat(starts - sources, lengths) + np.arange(len(data))] = data
+
+def encode_binary_copy(columns, types):
+    """Encode converted (values, valid) columns as one PostgreSQL binary COPY stream"""
+    rows = len(columns[0][1]) if columns else 0
+    fields = []
+    row_lengths = np.full(rows, 2, dtype=np.int64)
+    for (values, valid), col_type in zip(columns, types):
+        data, lengths = binary_column_values(values, valid, col_type)
+        sizes = np.full(rows, -1, dtype=np.int64)
+        sizes[valid] = lengths
+        fields.append((data, sizes, valid))
+        row_lengths += 4 + np.maximum(sizes, 0)
+    
+    body = np.empty(int(row_lengths.sum()), dtype=np.uint8)
+    offsets = np.cumsum(row_lengths) - row_lengths
+    field_count = np.array([len(columns)], dtype='>i2').view(np.uint8)
+    body[offsets[:, None] + np.arange(2)] = field_count
+    offsets = offsets + 2
+    
+    for data, sizes, valid in fields:
+        # Each field is its length (-1 for NULL) followed by its data
+        starts = offsets[valid]
+        lengths = sizes[valid]
+        if len(lengths) and (lengths == lengths[0]).all():
+            # Fixed-width values are copied with their length as one block per row
+            width = int(lengths[0])
+            block = np.empty((len(starts), 4 + width), dtype=np.uint8)
+            block[:, :4] = np.array([width], dtype='>i4').view(np.uint8)
+            block[:, 4:] = data.reshape(-1, width)
+            body[starts[:, None] + np.arange(4 + width)] = block
         else:
-            # Special handling for loaded_at column
-            if db_col == 'loaded_at':
-                matched_columns.append((db_col, None))  # Will handle special later
+            body[starts[:, None] + np.arange(4)] = lengths.astype('>i4').view(np.uint8).reshape(-1, 4)
+            scatter(body, starts + 4, data, lengths)
+        body[offsets[~valid][:, None] + np.arange(4)] = 0xff
+        offsets = offsets + 4 + np.maximum(sizes, 0)
+    
+    return BINARY_COPY_HEADER + body.tobytes() + BINARY_COPY_TRAILER
+
+def decode_binary_copy(data, types):
+    """Row tuples of a binary COPY stream built by encode_binary_copy
+
+    Only needed to retry a chunk that COPY rejected with INSERT, so it simply
+    walks the stream row by row.
+    """
+    data = memoryview(data)
+    rows = []
+    position = len(BINARY_COPY_HEADER)
+    while int.from_bytes(data[position:position + 2], 'big', signed=True) != -1:
+        position += 2
+        row = []
+        for col_type in types:
+            length = int.from_bytes(data[position:position + 4], 'big', signed=True)
+            position += 4
+            if length < 0:
+                row.append(None)
+                continue
+            row.append(decode_binary_field(data[position:position + length], col_type))
+            position += length
+        rows.append(tuple(row))
+    return rows
+
+def decode_binary_field(field, col_type):
+    """Python value of one binary COPY field, as the converters produce it"""
+    if col_type in TEXT_TYPES:
+        return bytes(field).decode('utf-8')
+    value = np.frombuffer(field, dtype=BINARY_FORMATS[col_type])[0]
+    if col_type == 'date':
+        return (PG_EPOCH.astype('datetime64[D]') + int(value)).item()
+    if col_type == 'timestamp without time zone':
+        return (PG_EPOCH + int(value)).item()
+    if col_type == 'boolean':
+        return bool(value)
+    return value.item()
+
+# Class holding a converted chunk as binary COPY data
+class BinaryCopyData:
+    def __init__(self, data, rows):
+        self.data = data
+        self.rows = rows
+    
+    def __len__(self):
+        return self.rows
+
+# Class holding everything needed to load one file, compiled once from its header
+class LoadPlan:
+    def __init__(self, table_name, columns, positions, converters, csv_columns, engine, types):
+        self.table_name = table_name
+        self.columns = columns
+        self.positions = positions
+        self.converters = converters
+        self.csv_columns = csv_columns
+        self.engine = engine
+        self.types = types
+        self.statements = {}
+        
+        # Rows lost to failed INSERT batches, so a partial load is reported
+        self.rejected_rows = 0
+        
+        # Chunks are sent as binary COPY data when every column type has an encoder
+        self.binary = all(col_type in BINARY_FORMATS or col_type in TEXT_TYPES for col_type in types)
+        
+        # Only the CSV columns that feed the table are read, in file order
+        self.usecols = sorted({position for position in positions if position is not None})
+        self.frame_positions = [self.usecols.index(position) if position is not None else None
+                                for position in positions]
+        
+        # What the reader can parse directly: text without type inference and
+        # dates with their known format. Numbers are left to the C parser's own
+        # inference, so a malformed value becomes NULL in the converter instead
+        # of failing the whole file.
+        self.text_positions = []
+        self.date_formats = {}
+        for position, col_type in zip(positions, types):
+            if position is None:
+                continue
+            if col_type in TEXT_TYPES:
+                self.text_positions.append(position)
+            elif col_type == 'date':
+                self.date_formats[position] = DATE_FORMAT
+            elif 'timestamp' in col_type:
+                self.date_formats[position] = TIMESTAMP_FORMAT
+    
+    @classmethod
+    def compile(cls, table_name, csv_columns, schema, result, engine=None):
+        """Match the CSV header to the table schema and pick a converter per column"""
+        matched_columns = match_columns(csv_columns, schema, result)
+        # loaded_at is always matched, so it alone does not make a usable file
+        if not any(csv_col is not None for _, csv_col in matched_columns):
+            raise ValueError("No columns matched between CSV and database table")
+        
+        col_types = dict(schema)
+        index = {col: i for i, col in enumerate(csv_columns)}
+        columns, positions, converters, types = [], [], [], []
+        for db_col, csv_col in matched_columns:
+            columns.append(db_col)
+            types.append(col_types[db_col])
+            # loaded_at without a CSV column has no position and is filled per chunk
+            positions.append(index[csv_col] if csv_col is not None else None)
+            converters.append(column_converter(col_types[db_col]) if csv_col is not None else None)
+        
+        return cls(table_name, columns, positions, converters, csv_columns, engine or PARSER_ENGINE, types)
+    
+    def __getstate__(self):
+        # Prepared statements belong to a connection and stay in this process
+        state = self.__dict__.copy()
+        state["statements"] = {}
+        return state
+    
+    def convert_columns(self, df):
+        """Convert a chunk holding the usecols to a (values, valid) pair per table column"""
+        # Get current timestamp for loaded_at
+        current_timestamp = np.datetime64(datetime.now(), 'us')
+        columns = []
+        
+        for position, converter in zip(self.frame_positions, self.converters):
+            if position is None:
+                columns.append((np.full(len(df), current_timestamp), np.ones(len(df), dtype=bool)))
             else:
-                result.log("WARNING", f"Column {db_col} not found in CSV")
+                series = df.iloc[:, position]
+                columns.append(converter(series, null_mask(series)))
+        return columns
     
-    if not matched_columns:
-        result.log("ERROR", "No columns matched between CSV and database table")
-        return False
+    def convert(self, df):
+        """Convert a chunk column by column, then materialise typed row tuples"""
+        return row_tuples(self.convert_columns(df))
     
-    # Prepare SQL parts
-    db_cols_sql = ', '.join([f'"{col[0]}"' for col in matched_columns])
-    placeholders = ', '.join([f'${i+1}' for i in range(len(matched_columns))])
+    def encode(self, df):
+        """Convert a chunk for writing: binary COPY data where possible, else row tuples"""
+        if self.binary and LOAD_METHOD == "copy":
+            columns = self.convert_columns(df)
+            try:
+                return BinaryCopyData(encode_binary_copy(columns, self.types), len(df))
+            except (OverflowError, TypeError):
+                return row_tuples(columns)
+        return self.convert(df)
     
-    # Prepare data insert query
-    insert_query = f'INSERT INTO "{table_name}" ({db_cols_sql}) VALUES ({placeholders})'
+    def passthrough_columns(self):
+        """Table columns in CSV order if every CSV column feeds exactly one of them, else None"""
+        # loaded_at without a CSV column is filled by the converters
+        if None in self.positions or sorted(self.positions) != list(range(len(self.csv_columns))):
+            return None
+        return [column for _, column in sorted(zip(self.positions, self.columns))]
     
-    # Create a prepared statement for better performance
-    prepared_stmt = await conn.prepare(insert_query)
+    async def insert_statement(self, conn):
+        """Return the INSERT statement prepared on conn, preparing it on first use"""
+        if conn not in self.statements:
+            # Prepare SQL parts
+            db_cols_sql = ', '.join([f'"{col}"' for col in self.columns])
+            placeholders = ', '.join([f'${i+1}' for i in range(len(self.columns))])
+            
+            # Prepare data insert query
+            insert_query = f'INSERT INTO "{self.table_name}" ({db_cols_sql}) VALUES ({placeholders})'
+            self.statements[conn] = await conn.prepare(insert_query)
+        return self.statements[conn]
+
+async def copy_records(conn, plan, records, result):
+    """Stream records into the table with COPY FROM STDIN"""
+    await conn.copy_records_to_table(plan.table_name, records=records, columns=plan.columns)
+    result.log("INFO", f"Copied {len(records)} rows into {plan.table_name}")
+    return len(records)
+
+async def copy_binary(conn, plan, chunk, result):
+    """Send a chunk already encoded as binary COPY data"""
+    await conn.copy_to_table(plan.table_name, source=chunk.data, columns=plan.columns, format='binary')
+    result.log("INFO", f"Copied {len(chunk)} rows into {plan.table_name} as binary")
+    return len(chunk)
+
+# PostgreSQL names of the encodings COPY can read a file in as is
+COPY_ENCODINGS = {'utf-8': 'UTF8', 'utf-8-sig': 'UTF8', 'latin1': 'LATIN1'}
+
+async def copy_csv_file(conn, source, encoding, table_name, columns, result):
+    """Stream the raw CSV bytes into COPY FROM STDIN, leaving all parsing to PostgreSQL"""
+    # Streams are only opened and read from worker threads, as asyncpg reads them too
+    with await asyncio.to_thread(source.open) as f:
+        # The header line is skipped by COPY; a BOM before it is dropped here
+        if encoding == 'utf-8-sig':
+            await asyncio.to_thread(f.read, len(codecs.BOM_UTF8))
+        status = await conn.copy_to_table(
+            table_name, source=f, columns=columns, format='csv', header=True,
+            encoding=COPY_ENCODINGS[encoding])
     
-    # Get current timestamp for loaded_at
-    current_timestamp = datetime.now()
+    rows = int(status.split()[-1])
+    result.log("INFO", f"Copied {rows} rows into {table_name} without client-side parsing")
+    return rows
+
+async def insert_records(conn, plan, records, result):
+    """Insert records with the plan's prepared INSERT statement in batches"""
+    prepared_stmt = await plan.insert_statement(conn)
     
     # Insert data in batches
     batch_size = 1000
     rows_inserted = 0
     
     # Process in batches
-    total_rows = len(df)
+    total_rows = len(records)
     for start_idx in range(0, total_rows, batch_size):
         end_idx = min(start_idx + batch_size, total_rows)
-        batch_data = []
-        
-        # Process each row in the batch
-        for _, row in df.iloc[start_idx:end_idx].iterrows():
-            row_data = []
-            for db_col, df_col in matched_columns:
-                # Find data type for this column
-                col_type = next(schema_col[1] for schema_col in schema if schema_col[0] == db_col)
-                
-                # Special handling for loaded_at
-                if db_col == 'loaded_at' and df_col is None:
-                    row_data.append(current_timestamp)
-                    continue
-                
-                value = row[df_col] if df_col is not None else None
-                
-                # Handle type conversions based on PostgreSQL data type
-                if pd.isna(value) or value == '':
-                    row_data.append(None)
-                
-                # Handle integer types
-                elif col_type in ('integer', 'bigint', 'smallint'):
-                    try:
-                        row_data.append(int(value))
-                    except (ValueError, TypeError):
-                        row_data.append(None)
-                
-                # Handle numeric types
-                elif col_type in ('numeric', 'decimal', 'real', 'double precision'):
-                    try:
-                        row_data.append(float(value))
-                    except (ValueError, TypeError):
-                        row_data.append(None)
-                
-                # Handle date type
-                elif col_type == 'date':
-                    try:
-                        if isinstance(value, str):
-                            # Parse date string into date object
-                            row_data.append(datetime.strptime(value, '%Y-%m-%d').date())
-                        else:
-                            row_data.append(value)
-                    except (ValueError, TypeError):
-                        row_data.append(None)
-                
-                # Handle timestamp types
-                elif 'timestamp' in col_type:
-                    try:
-                        if isinstance(value, str):
-                            # Parse timestamp string
-                            row_data.append(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'))
-                        else:
-                            row_data.append(value)
-                    except (ValueError, TypeError):
-                        row_data.append(None)
-                
-                # All other types (strings, etc.)
-                else:
-                    row_data.append(value)
-            
-            batch_data.append(tuple(row_data))
+        batch_data = records[start_idx:end_idx]
         
         # Execute the batch
         if batch_data:
@@ -257,67 +1862,502 @@ async def process_dataframe(conn, df, table_name, schema, result):
                 result.log("INFO", f"Inserted batch {start_idx}-{end_idx} of {total_rows} rows")
             except Exception as e:
                 result.log("ERROR", f"Error inserting batch: {e}")
-                # Continue with next batch anyway
+                # Continue with next batch anyway, counting the rows left out
+                plan.rejected_rows += len(batch_data)
     
-    result.log("INFO", f"Inserted {rows_inserted} rows into {table_name}")
     return rows_inserted
 
-async def import_data(csv_file, table_name, download_dir, pool, result):
-    result.log("INFO", f"Processing {csv_file} into table {table_name}...")
+def match_columns(csv_columns, schema, result):
+    """Match table columns to CSV columns case-insensitively"""
+    # Index CSV columns by lower-cased name; the first occurrence wins
+    csv_index = {}
+    for csv_col in csv_columns:
+        csv_index.setdefault(csv_col.lower(), csv_col)
+    
+    # Match available columns from dataframe to database schema
+    matched_columns = []
+    for db_col, _ in schema:
+        match = csv_index.get(db_col.lower())
+        
+        if match:
+            matched_columns.append((db_col, match))
+        else:
+            # Special handling for loaded_at column
+            if db_col == 'loaded_at':
+                matched_columns.append((db_col, None))  # Will handle special later
+            else:
+                result.log("WARNING", f"Column {db_col} not found in CSV")
+    
+    return matched_columns
+
+async def write_records(conn, plan, records, result, load_method=None):
+    """Write converted records with the configured load method"""
+    load_method = load_method or LOAD_METHOD
+    if not records:
+        return 0
     
-    # Get a connection from the pool
-    async with pool.acquire() as conn:
-        # Truncate the target table
+    # COPY is the fast path; a failed COPY writes nothing, so the
+    # INSERT path can safely retry the same records
+    if isinstance(records, BinaryCopyData):
         try:
-            result.log("INFO", f"Truncating table {table_name}...")
-            await conn.execute(f'TRUNCATE TABLE "{table_name}" RESTART IDENTITY CASCADE')
+            return await copy_binary(conn, plan, records, result)
         except Exception as e:
-            result.log("WARNING", f"Could not truncate table: {e}")
+            # INSERT skips only the failing batches instead of the whole chunk
+            result.log("WARNING", f"Binary COPY into {plan.table_name} failed, falling back to INSERT: {e}")
+            records = decode_binary_copy(records.data, plan.types)
+    elif load_method == "copy":
+        try:
+            rows_inserted = await copy_records(conn, plan, records, result)
+            result.log("INFO", f"Inserted {rows_inserted} rows into {plan.table_name}")
+            return rows_inserted
+        except Exception as e:
+            result.log("WARNING", f"COPY into {plan.table_name} failed, falling back to INSERT: {e}")
+    
+    rows_inserted = await insert_records(conn, plan, records, result)
+    
+    result.log("INFO", f"Inserted {rows_inserted} rows into {plan.table_name}")
+    return rows_inserted
+
+def decode_latin1_fallback(error):
+    """Codec error handler decoding bytes that are not valid UTF-8 as latin1"""
+    return error.object[error.start:error.end].decode('latin1'), error.end
+
+codecs.register_error('latin1_fallback', decode_latin1_fallback)
+
+# Encodings a pure ASCII file may have been detected as before
+ASCII_ENCODINGS = ('utf-8', 'utf-8-sig', 'latin1')
+
+def sample_encoding(sample, hint=None):
+    """Pick a file's encoding from a bounded sample of its first bytes
+
+    A BOM decides the encoding outright. Otherwise invalid UTF-8 in the sample
+    means latin1, non-ASCII UTF-8 means utf-8, and a pure ASCII sample keeps
+    the encoding remembered for this file (hint) if it reads ASCII as ASCII.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    
+    try:
+        # Not final: the sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'latin1'
+    
+    # A file that used to be sent as UTF-16 may now be plain ASCII
+    if sample.isascii() and hint in ASCII_ENCODINGS:
+        return hint
+    return 'utf-8'
+
+def open_csv_text(raw, encoding):
+    """Wrap a binary stream in an incremental decoder for the given encoding
+
+    UTF-8 files decode stray invalid bytes as latin1 instead of failing half
+    way through, since only the start of the file was sampled.
+    """
+    errors = 'latin1_fallback' if encoding.startswith('utf-8') else 'strict'
+    return io.TextIOWrapper(raw, encoding=encoding, errors=errors, newline='')
+
+def clean_columns(columns):
+    """Strip whitespace and BOM characters from column names"""
+    return [col.strip().replace('\ufeff', '') for col in columns]
+
+def parse_csv_header(head, encoding):
+    """Read the cleaned column names from the first bytes of a CSV file"""
+    # The bytes may stop in the middle of a character after the header line
+    errors = 'latin1_fallback' if encoding.startswith('utf-8') else 'replace'
+    return clean_columns(next(csv.reader(io.StringIO(head.decode(encoding, errors=errors))), []))
+
+def read_header_line(open_stream, block_size, limit):
+    """Read a blocking binary stream up to the end of its first line"""
+    head = b''
+    with open_stream() as f:
+        while b'\n' not in head and len(head) < limit:
+            block = f.read(block_size)
+            if not block:
+                break
+            head += block
+    return head
+
+async def read_remote_header(sftp, name, block_size=64 * 1024, limit=1024 * 1024):
+    """Read the start of a remote CSV input up to the end of its header line
+    
+    Compressed files are decompressed as far as they were read; zip members
+    are found through the archive's directory.
+    """
+    remote_file, member = split_member(name)
+    head = b''
+    async with sftp.open(remote_file, 'rb') as f:
+        if member is not None:
+            size = (await sftp.stat(remote_file)).size
+            archive = io.BufferedReader(SFTPRandomAccess(f, size, asyncio.get_running_loop()),
+                                        buffer_size=block_size)
+            return await asyncio.to_thread(read_header_line, functools.partial(open_decompressed, archive, name),
+                                           block_size, limit)
         
+        decompress = head_decompressor(name)
+        offset = 0
+        while b'\n' not in head and len(head) < limit:
+            block = await f.read(block_size, offset)
+            if not block:
+                break
+            offset += len(block)
+            head += decompress(block)
+    return head
+
+# Parser engines take a binary stream positioned at the header line and yield
+# DataFrames of about chunk_size rows holding the plan's usecols
+def parse_with_pandas(raw, encoding, plan, chunk_size):
+    """pandas C parser, reading text and dates as their final types and inferring numbers"""
+    # Positional names, as CSV headers may repeat or hold invisible characters
+    names = [f"_{i}" for i in range(len(plan.csv_columns))]
+    date_formats = {names[position]: fmt for position, fmt in plan.date_formats.items()}
+    
+    with open_csv_text(raw, encoding) as text:
+        with pd.read_csv(text, header=0, names=names, usecols=[names[i] for i in plan.usecols],
+                         dtype={names[i]: str for i in plan.text_positions},
+                         # Columns not matching the format stay text for the converter
+                         parse_dates=list(date_formats), date_format=date_formats,
+                         chunksize=chunk_size) as reader:
+            for chunk_df in reader:
+                chunk_df.columns = [plan.csv_columns[i] for i in plan.usecols]
+                yield chunk_df
+
+def parse_with_pyarrow(raw, encoding, plan, chunk_size):
+    """Multithreaded pyarrow parser, reading the used fields as text for the converters"""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        raise ImportError("The pyarrow parser engine requires the pyarrow package") from None
+    
+    names = [f"_{i}" for i in range(len(plan.csv_columns))]
+    usecols = [names[i] for i in plan.usecols]
+    read_options = pa_csv.ReadOptions(
+        column_names=names, skip_rows=1, use_threads=True,
+        # pyarrow skips a UTF-8 BOM itself
+        encoding='utf8' if encoding.startswith('utf-8') else encoding)
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=usecols, column_types={name: pa.string() for name in usecols},
+        strings_can_be_null=True)
+    # Quoted fields may span lines, as with the other engines
+    parse_options = pa_csv.ParseOptions(newlines_in_values=True)
+    
+    batches, rows = [], 0
+    for batch in pa_csv.open_csv(raw, read_options=read_options, parse_options=parse_options,
+                                 convert_options=convert_options):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_size:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+def parse_with_csv(raw, encoding, plan, chunk_size):
+    """Lightweight stdlib csv parser for small files; fields stay text and only empty ones are NULL"""
+    columns = [plan.csv_columns[i] for i in plan.usecols]
+    with open_csv_text(raw, encoding) as text:
+        # Blank lines are skipped like the other engines do, not read as all-NULL rows
+        rows = filter(None, csv.reader(text))
+        next(rows, None)
+        while batch := list(itertools.islice(rows, chunk_size)):
+            batch = [[row[i] if i < len(row) else None for i in plan.usecols] for row in batch]
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+
+PARSER_ENGINES = {
+    'pandas': parse_with_pandas,
+    'pyarrow': parse_with_pyarrow,
+    'csv': parse_with_csv
+}
+
+def parser_engine(table_name):
+    """Return the parser engine configured for a table"""
+    engine = TABLE_PARSER_ENGINES.get(table_name, PARSER_ENGINE)
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f"Unknown parser engine '{engine}' for table {table_name}")
+    return engine
+
+def read_csv_chunks(source, encoding, chunk_size, plan, result):
+    """Yield the CSV as DataFrames of about chunk_size rows, decoding the file once"""
+    parse = PARSER_ENGINES[plan.engine]
+    rows, seconds = 0, 0.0
+    
+    with source.open() as raw:
+        chunks = parse(raw, encoding, plan, chunk_size)
+        while True:
+            started = time.perf_counter()
+            chunk_df = next(chunks, None)
+            seconds += time.perf_counter() - started
+            if chunk_df is None:
+                break
+            rows += len(chunk_df)
+            yield chunk_df
+    
+    result.record_parse(plan.engine, rows, source.size, seconds)
+
+def split_csv_ranges(filepath, range_size, block_size=8 * 1024 * 1024):
+    """Split a CSV into byte ranges that start and end on record boundaries
+
+    Returns the header line and a list of (start, end) offsets. A newline only
+    ends a record when an even number of quotes precede it, so newlines inside
+    quoted fields never split a record.
+    """
+    file_size = os.path.getsize(filepath)
+    ranges = []
+    
+    with open(filepath, 'rb') as f:
+        header = f.readline()
+        start = len(header)
+        target = start + range_size
+        offset = start
+        quotes = 0
+        
+        while target < file_size:
+            block = f.read(block_size)
+            if not block:
+                break
+            block_end = offset + len(block)
+            pos = 0
+            
+            while target < block_end:
+                newline = block.find(b'\n', max(target - offset, pos))
+                if newline == -1:
+                    break
+                quotes += block.count(b'"', pos, newline)
+                pos = newline + 1
+                if quotes % 2 == 0:
+                    ranges.append((start, offset + pos))
+                    start = offset + pos
+                    target = start + range_size
+            
+            quotes += block.count(b'"', pos)
+            offset = block_end
+    
+    if start < file_size:
+        ranges.append((start, file_size))
+    return header, ranges
+
+def parse_csv_range(filepath, encoding, header, start, end, plan):
+    """Parse and convert one byte range of a CSV file (runs in a worker process)
+
+    Returns the converted chunks and the seconds spent parsing them.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    
+    converted, seconds = [], 0.0
+    chunks = PARSER_ENGINES[plan.engine](BytesIO(header + data), encoding, plan, CHUNK_SIZE)
+    while True:
+        started = time.perf_counter()
+        df = next(chunks, None)
+        seconds += time.perf_counter() - started
+        if df is None:
+            break
+        converted.append(plan.encode(df))
+    return converted, seconds
+
+async def load_file_parallel(conn, pool, filepath, encoding, plan, result):
+    """Parse byte ranges of one file in worker processes and write them over several connections"""
+    header, ranges = await asyncio.to_thread(
+        split_csv_ranges, filepath, int(PARALLEL_RANGE_MB * 1024 * 1024))
+    
+    # A merge keeps the last row of each key by physical order, which only
+    # follows the file when the ranges are written one after another
+    writer_count = 1 if LOAD_STRATEGY == "merge" else PARALLEL_WRITERS
+    result.log("INFO", f"Split {os.path.basename(filepath)} into {len(ranges)} ranges "
+                       f"for {PARALLEL_WORKERS} workers and {writer_count} writers")
+    
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(PARALLEL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    
+    # The queue holds submitted ranges, bounding how many are parsed ahead of the writers
+    parsed_ranges = asyncio.Queue(maxsize=PARALLEL_WORKERS * 2)
+    rows_imported = 0
+    
+    async def submit_stage():
+        for start, end in ranges:
+            future = loop.run_in_executor(
+                executor, parse_csv_range, filepath, encoding, header, start, end, plan)
+            await parsed_ranges.put((future, end - start))
+        for _ in range(writer_count):
+            await parsed_ranges.put(None)
+    
+    async def write_stage(writer_conn):
+        nonlocal rows_imported
+        while (parsed := await parsed_ranges.get()) is not None:
+            future, nbytes = parsed
+            converted, seconds = await future
+            result.record_parse(plan.engine, sum(map(len, converted)), nbytes, seconds)
+            for records in converted:
+                written = await write_records(writer_conn, plan, records, result)
+                rows_imported += written
+    
+    async def pooled_write_stage():
+        async with pool.acquire() as writer_conn:
+            await write_stage(writer_conn)
+    
+    try:
+        # The table's own connection is one of the writers
+        writers = [write_stage(conn)] + [pooled_write_stage() for _ in range(writer_count - 1)]
+        await run_stages(submit_stage(), *writers)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return rows_imported
+
+def close_reader(reader):
+    """Close a chunk generator, unless a worker thread is still advancing it"""
+    try:
+        reader.close()
+    except ValueError:
+        pass
+
+async def run_stages(*stages):
+    """Run pipeline stages concurrently, cancelling the others if one fails"""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def load_csv_pipeline(conn, source, encoding, plan, result):
+    """Stream one file through the parse, convert and write stages"""
+    result.log("INFO", f"Streaming {source.name} as {encoding} with the {plan.engine} parser "
+                       f"in chunks of {CHUNK_SIZE} rows")
+    
+    # Parsing, conversion and writes overlap, with at most
+    # PIPELINE_QUEUE_SIZE chunks buffered between each stage
+    parsed_chunks = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    converted_chunks = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    rows_imported = 0
+    
+    async def parse_stage():
+        reader = read_csv_chunks(source, encoding, CHUNK_SIZE, plan, result)
+        try:
+            while (chunk_df := await asyncio.to_thread(next, reader, None)) is not None:
+                await parsed_chunks.put(chunk_df)
+        finally:
+            close_reader(reader)
+        await parsed_chunks.put(None)
+    
+    async def convert_stage():
+        start = 0
+        while (chunk_df := await parsed_chunks.get()) is not None:
+            end = start + len(chunk_df)
+            result.log("INFO", f"Processing chunk (rows {start}-{end})")
+            records = await asyncio.to_thread(plan.encode, chunk_df)
+            await converted_chunks.put(records)
+            start = end
+        await converted_chunks.put(None)
+    
+    async def write_stage():
+        nonlocal rows_imported
+        while (records := await converted_chunks.get()) is not None:
+            rows_imported += await write_records(conn, plan, records, result)
+    
+    await run_stages(parse_stage(), convert_stage(), write_stage())
+    return rows_imported
+
+async def load_file(conn, pool, source, encoding, plan, result):
+    """Load one CSV file as planned, picking the parallel or streaming path by size"""
+    # Read CSV with pandas - handle encodings and BOM characters
+    file_size = source.size / (1024 * 1024)  # Size in MB
+    
+    result.log("INFO", f"Reading CSV file {source.name} (size: {file_size:.1f} MB)")
+    
+    # Files whose columns map one to one onto the table go to COPY unparsed;
+    # if PostgreSQL rejects a value the COPY leaves no rows and the file is converted
+    columns = plan.passthrough_columns()
+    if COPY_PASSTHROUGH and LOAD_METHOD == "copy" and columns and encoding in COPY_ENCODINGS:
+        try:
+            return await copy_csv_file(conn, source, encoding, plan.table_name, columns, result)
+        except asyncpg.PostgresError as e:
+            result.log("WARNING", f"COPY passthrough failed, converting {source.name} instead: {e}")
+    
+    # Large downloaded files are split into ranges loaded by several processes and
+    # connections; byte ranges only line up with records in ASCII-compatible encodings
+    if (PARALLEL_WORKERS > 1 and file_size >= PARALLEL_FILE_THRESHOLD_MB and encoding != 'utf-16'
+            and source.path is not None):
+        return await load_file_parallel(conn, pool, source.path, encoding, plan, result)
+    
+    return await load_csv_pipeline(conn, source, encoding, plan, result)
+
+async def import_data(source, table_name, pool, result, encoding_hint=None, plan=None):
+    csv_file = source.name
+    result.log("INFO", f"Processing {csv_file} into table {table_name} "
+                       f"(load method: {LOAD_METHOD}, strategy: {LOAD_STRATEGY})...")
+    
+    # Get a connection from the pool once no other job is loading the table
+    async with table_lock(table_name, result), pool.acquire() as conn:
         # Get table schema
         schema = await get_table_schema(conn, table_name, result)
         if not schema:
             result.log("ERROR", f"Could not retrieve schema for table {table_name}")
+            result.failed_files.append(csv_file)
             return 0
         
+        # Column mapping, converters and statements are worked out once for the
+        # whole file, before the table is touched, so a mismatched file fails fast.
+        # The plan may already have been compiled from the remote header.
         try:
-            # Read CSV with pandas - handle encodings and BOM characters
-            filepath = os.path.join(download_dir, csv_file)
-            file_size = os.path.getsize(filepath) / (1024 * 1024)  # Size in MB
-            
-            result.log("INFO", f"Reading CSV file {csv_file} (size: {file_size:.1f} MB)")
-            
-            # Try different encodings if needed
+            head = await source.read_head(ENCODING_SAMPLE_BYTES)
+            encoding = sample_encoding(head, encoding_hint)
+            result.file_encodings[csv_file] = encoding
+            if plan is None:
+                plan = LoadPlan.compile(table_name, parse_csv_header(head, encoding), schema,
+                                        result, parser_engine(table_name))
+        except ValueError as e:
+            result.log("ERROR", f"Cannot import {csv_file}: {e}")
+            result.failed_files.append(csv_file)
+            return 0
+        
+        # Swap and merge load into a staging table; otherwise, or when the table
+        # cannot use them, truncate the live table and load it in place
+        staging = None
+        if LOAD_STRATEGY == "swap":
+            staging = await create_staging_table(conn, table_name, result)
+        elif LOAD_STRATEGY == "merge":
             try:
-                df = pd.read_csv(filepath, encoding='utf-8')
-            except UnicodeDecodeError:
-                try:
-                    df = pd.read_csv(filepath, encoding='latin1')
-                except:
-                    df = pd.read_csv(filepath, encoding='utf-8-sig')  # Handle BOM
+                staging = await create_merge_table(conn, table_name, plan.csv_columns, schema, result)
+            except ValueError as e:
+                result.log("ERROR", f"Cannot merge {csv_file}: {e}")
+                result.failed_files.append(csv_file)
+                return 0
+        
+        if staging is None:
+            # Truncate the target table
+            try:
+                result.log("INFO", f"Truncating table {table_name}...")
+                await conn.execute(f'TRUNCATE TABLE "{table_name}" RESTART IDENTITY CASCADE')
+            except Exception as e:
+                result.log("WARNING", f"Could not truncate table: {e}")
+        
+        try:
+            # Staging tables hold the same columns under another name
+            plan.table_name = staging["name"] if staging else table_name
+            rows_imported = await load_file(conn, pool, source, encoding, plan, result)
             
-            # Clean column names (remove any invisible characters)
-            df.columns = [col.strip().replace('\ufeff', '') for col in df.columns]
+            # A partial load is not recorded in the manifest, so it is retried. Nor
+            # is it swapped or merged in: the live table keeps its rows, which
+            # MERGE_DELETE_MISSING would otherwise delete for the failed batches.
+            if plan.rejected_rows:
+                result.log("ERROR", f"{plan.rejected_rows} rows of {csv_file} could not be inserted")
+                result.failed_files.append(csv_file)
+                if staging is not None:
+                    result.log("INFO", f"Leaving {table_name} unchanged")
+                    return 0
+                return rows_imported
             
-            rows_imported = 0
-            
-            # Check if file needs to be processed in chunks
-            if file_size > 10:  # If file is larger than 10MB
-                result.log("INFO", f"Large file detected, processing in chunks of {CHUNK_SIZE} rows")
-                total_rows = len(df)
-                
-                # Process in chunks
-                for start in range(0, total_rows, CHUNK_SIZE):
-                    end = min(start + CHUNK_SIZE, total_rows)
-                    result.log("INFO", f"Processing chunk (rows {start}-{end})")
-                    chunk_df = df.iloc[start:end].copy()
-                    
-                    # Process this chunk and wait for it to complete
-                    chunk_rows = await process_dataframe(conn, chunk_df, table_name, schema, result)
-                    rows_imported += chunk_rows
-            else:
-                # Process the entire dataframe
-                rows_imported = await process_dataframe(conn, df, table_name, schema, result)
+            if staging is not None and staging["strategy"] == "swap":
+                await swap_staging_table(conn, staging, result)
+            elif staging is not None:
+                await merge_staging_table(conn, staging, result)
             
             result.log("INFO", f"✅ Completed import of {csv_file}")
             return rows_imported
@@ -326,38 +2366,178 @@ async def import_data(csv_file, table_name, download_dir, pool, result):
             result.log("ERROR", f"Error processing {csv_file}: {e}")
             import traceback
             result.log("ERROR", traceback.format_exc())
+            result.failed_files.append(csv_file)
             return 0
+        finally:
+            # A failed load leaves the live table untouched; after a swap
+            # the staging name no longer exists and this is a no-op
+            if staging is not None:
+                await drop_staging_table(conn, staging, result)
+
+async def import_files(downloaded, dependencies, open_source, pool, result, manifest=None, plans=None,
+                       in_flight=None):
+    """Import files as they are downloaded, loading each table after the tables it references
 
-async def run_import():
-    """Main import function that can be called from API"""
-    result = ImportResult()
+    open_source gives an async context manager yielding the source of a file
+    by name. plans holds the LoadPlans already compiled from the remote
+    headers, by file name. Each file is released from in_flight once imported.
+    """
+    finished = collections.defaultdict(asyncio.Event)
+    slots = asyncio.Semaphore(MAX_CONCURRENT_TABLES)
+    
+    async def import_file(csv_file):
+        # Extract table name from filename
+        table_name = table_for(csv_file)
+        try:
+            # Tables skipped as unchanged are not reloaded, so there is nothing to wait for
+            skipped = {table_for(f) for f in result.skipped_files}
+            for parent in dependencies.get(table_name, ()):
+                if parent not in skipped:
+                    await finished[parent].wait()
+            
+            async with open_source(csv_file) as source:
+                # Streamed files are only hashed while they are imported
+                content_hash = await source.content_hash() if manifest is not None else None
+                if content_hash is not None and manifest.content_unchanged(
+                        csv_file, table_name, content_hash, dependencies):
+                    result.log("INFO", f"Skipping {csv_file}, content unchanged since last import")
+                    result.skipped_files.append(csv_file)
+                    await manifest.record(csv_file, table_name, content_hash, result)
+                    return
+                
+                # Each running import holds its own pool connection
+                async with slots:
+                    encoding_hint = manifest.encoding_hint(csv_file) if manifest is not None else None
+                    plan = plans.get(csv_file) if plans is not None else None
+                    rows_imported = await import_data(source, table_name, pool, result, encoding_hint, plan)
+                result.processed_files.append((csv_file, rows_imported))
+                if source.transfer is not None:
+                    result.record_transfer(csv_file, *source.transfer)
+                
+                if manifest is not None and csv_file not in result.failed_files:
+                    content_hash = content_hash or await source.content_hash()
+                    if content_hash is not None:
+                        await manifest.record(csv_file, table_name, content_hash, result)
+        finally:
+            finished[table_name].set()
+            if in_flight is not None:
+                in_flight.release(csv_file)
+    
+    tasks = []
+    arrived = set()
+    while (csv_file := await downloaded.get()) is not None:
+        if isinstance(csv_file, DroppedFile):
+            # Tables referencing it must not wait for the end of the queue, which
+            # may itself wait for their imports to free a download slot
+            finished[table_for(csv_file.name)].set()
+            continue
+        arrived.add(table_for(csv_file))
+        tasks.append(asyncio.ensure_future(import_file(csv_file)))
+    
+    # Files that never arrived must not block the tables that reference them
+    for table_name in dependencies:
+        if table_name not in arrived:
+            finished[table_name].set()
+    
+    await run_stages(*tasks)
+
+async def run_import(force=False, connections=None, result=None):
+    """Main import function that can be called from API
+
+    With force, files are imported even if the manifest shows them unchanged.
+    Without a shared ConnectionManager, connections are opened for this run only.
+    A given ImportResult is filled in as the import runs, so callers can
+    report its progress.
+    """
+    if result is None:
+        result = ImportResult()
     result.log("INFO", "Starting CSV import process...")
     
-    # Create a temporary directory for downloads
-    download_dir = tempfile.mkdtemp()
-    result.log("INFO", f"Created temporary directory: {download_dir}")
+    # Partial downloads in DOWNLOAD_DIR are kept for the next run, while
+    # completed ones go to a directory of this job, so jobs running at the
+    # same time never delete each other's files; otherwise downloads go to
+    # a temporary directory
+    job_lock = None
+    if DOWNLOAD_DIR:
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        download_dir, job_lock = create_job_dir(DOWNLOAD_DIR, result)
+        result.log("INFO", f"Using download directory: {download_dir}")
+    else:
+        download_dir = tempfile.mkdtemp()
+        result.log("INFO", f"Created temporary directory: {download_dir}")
+    
+    owns_connections = connections is None
+    if owns_connections:
+        connections = ConnectionManager()
     
+    download_task = None
     try:
-        # Download files from SFTP
-        files = await download_files(download_dir, result)
-        if not files:
-            result.log("ERROR", "No files were downloaded. Exiting.")
-            result.complete(False)
-            return result
+        manifest = None
+        dependencies = {}
+        pool_ready = asyncio.Event()
         
-        # Create connection pool
-        result.log("INFO", "Creating database connection pool...")
-        pool = await asyncpg.create_pool(PG_CONN_STRING)
+        async def select_files(entries):
+            await pool_ready.wait()
+            
+            # Order the target tables by their foreign keys
+            table_names = [table_for(entry.filename) for entry in entries]
+            async with pool.acquire() as conn:
+                dependencies.update(await get_table_dependencies(conn, table_names, result))
+            
+            if manifest is None:
+                return [entry.filename for entry in entries]
+            selected = manifest.select(entries, dependencies, result)
+            await manifest.invalidate(selected, result)
+            return selected
         
-        # Import files (process each file one at a time to avoid database conflicts)
-        for csv_file in files:
-            # Extract table name from filename
-            table_name = os.path.splitext(csv_file)[0]
-            rows_imported = await import_data(csv_file, table_name, download_dir, pool, result)
-            result.processed_files.append((csv_file, rows_imported))
+        async def check_header(csv_file, head):
+            # Resolve the column mapping from the remote header, so a file that
+            # cannot be loaded is not downloaded at all
+            table_name = table_for(csv_file)
+            hint = manifest.encoding_hint(csv_file) if manifest is not None else None
+            try:
+                csv_columns = parse_csv_header(head, sample_encoding(head, hint))
+                async with pool.acquire() as conn:
+                    schema = await get_table_schema(conn, table_name, result)
+                if not schema:
+                    raise ValueError(f"Could not retrieve schema for table {table_name}")
+                plans[csv_file] = LoadPlan.compile(table_name, csv_columns, schema, result,
+                                                   parser_engine(table_name))
+            except ValueError as e:
+                result.log("ERROR", f"Not downloading {csv_file}: {e}")
+                result.failed_files.append(csv_file)
+                return False
+            except Exception as e:
+                result.log("WARNING", f"Could not check the header of {csv_file}: {e}")
+            return True
         
-        # Close the connection pool
-        await pool.close()
+        # Download files from SFTP; each file is queued as soon as it lands and
+        # deleted once imported, with at most MAX_FILES_IN_FLIGHT on disk
+        plans = {}
+        downloaded = asyncio.Queue()
+        in_flight = FileSlots(MAX_FILES_IN_FLIGHT, dependencies, None if STREAM_FROM_SFTP else download_dir)
+        download_task = asyncio.create_task(
+            download_files(download_dir, result, connections, downloaded, select_files, check_header, in_flight,
+                           DOWNLOAD_DIR or None))
+        
+        # Get the connection pool while the SFTP session is opened
+        pool = await connections.get_pool()
+        if SKIP_UNCHANGED:
+            manifest = await ImportManifest.load(pool, result, force)
+        pool_ready.set()
+        
+        # Import independent tables concurrently, in the order they finish downloading
+        if STREAM_FROM_SFTP:
+            open_source = functools.partial(open_sftp_source, connections)
+        else:
+            open_source = functools.partial(open_local_source, download_dir)
+        await import_files(downloaded, dependencies, open_source, pool, result, manifest, plans, in_flight)
+        
+        files = await download_task
+        if files is None or (not files and not result.skipped_files):
+            result.log("ERROR", "No files were downloaded. Exiting.")
+            result.complete(False)
+            return result
         
         result.log("INFO", "All imports completed!")
         result.complete(True)
@@ -368,8 +2548,14 @@ async def run_import():
         result.log("ERROR", traceback.format_exc())
         result.complete(False)
     finally:
+        if download_task is not None and not download_task.done():
+            download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
+        if owns_connections:
+            await connections.close()
+        
         try:
-            result.log("INFO", "Cleaning up temporary directory...")
+            result.log("INFO", "Cleaning up download directory...")
             # Close any open file handles first
             import gc
             gc.collect()
@@ -378,15 +2564,18 @@ async def run_import():
             
             # Try to remove the directory, but don't crash if it fails
             try:
-                for root, dirs, files in os.walk(download_dir):
-                    for f in files:
-                        os.unlink(os.path.join(root, f))
-                    for d in dirs:
-                        os.rmdir(os.path.join(root, d))
-                os.rmdir(download_dir)
-                result.log("INFO", "Temporary directory cleaned up")
+                if job_lock is not None:
+                    # Only this job's directory goes; partial downloads are resumed next run
+                    remove_dir(download_dir, keep=job_lock.name)
+                    result.log("INFO", "Completed downloads cleaned up")
+                else:
+                    remove_dir(download_dir)
+                    result.log("INFO", "Temporary directory cleaned up")
             except Exception as e:
                 result.log("WARNING", f"Could not completely clean up temporary directory: {e}")
+            finally:
+                if job_lock is not None:
+                    job_lock.close()
         except Exception as e:
             result.log("WARNING", f"Error during cleanup: {e}")
     
@@ -0,0 +1,340 @@
+import os
+import abc
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import collections
+import contextlib
+import copy
+import logging
+import asyncpg
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from dotenv import load_dotenv
+
+from app.import_script import PG_CONN_STRING
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_STORE = os.getenv("JOB_STORE", "memory").lower()  # "memory", "sqlite" or "postgres"
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "import_jobs.db")  # SQLite file of the sqlite store
+JOB_TABLE = os.getenv("JOB_TABLE", "csv_import_jobs")  # Table and NOTIFY channel of the postgres store
+JOB_RETENTION_COUNT = int(os.getenv("JOB_RETENTION_COUNT", "1000"))  # Most recent jobs kept
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "168"))  # Jobs are forgotten this long after their last update
+JOB_LOG_LINES = int(os.getenv("JOB_LOG_LINES", "1000"))  # Last log lines kept per job
+JOB_PROGRESS_SECONDS = float(os.getenv("JOB_PROGRESS_SECONDS", "5"))  # How often running jobs save their progress
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))  # Running jobs silent this long count as interrupted
+JOB_POOL_SIZE = int(os.getenv("JOB_POOL_SIZE", "2"))  # Connections of the postgres store, apart from the import pool
+JOB_STORE_TIMEOUT = float(os.getenv("JOB_STORE_TIMEOUT", "10"))  # Seconds to get a connection or run a job store query
+
+# Statuses of jobs that have not finished yet
+ACTIVE_STATUSES = ("starting", "running")
+
+# Jobs are plain dicts holding "status", "start_time" and "result", the
+# summary of a finished run, or "progress" while running; their log lines are
+# stored next to them.
+class JobStore(abc.ABC):
+    def __init__(self):
+        self.watchers = collections.defaultdict(set)
+    
+    async def start(self):
+        pass
+    
+    async def close(self):
+        pass
+    
+    @abc.abstractmethod
+    async def save(self, job_id: str, job: Dict[str, Any], logs: Optional[List[str]] = None):
+        """Create or replace a job, keeping its stored logs if none are given"""
+    
+    @abc.abstractmethod
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job, or None if it is unknown or expired"""
+    
+    @abc.abstractmethod
+    async def get_logs(self, job_id: str) -> Optional[List[str]]:
+        """The stored log lines of the job, or None if it is unknown or expired"""
+    
+    @contextlib.asynccontextmanager
+    async def watch(self, job_id: str):
+        """Yield an event that is set when the job is next saved"""
+        event = asyncio.Event()
+        self.watchers[job_id].add(event)
+        try:
+            yield event
+        finally:
+            self.watchers[job_id].discard(event)
+            if not self.watchers[job_id]:
+                del self.watchers[job_id]
+    
+    def notify(self, job_id: str):
+        for event in self.watchers.get(job_id, ()):
+            event.set()
+
+# Class keeping the most recently used jobs in process memory
+class MemoryJobStore(JobStore):
+    def __init__(self, max_jobs=JOB_RETENTION_COUNT, ttl_hours=JOB_RETENTION_HOURS):
+        super().__init__()
+        self.max_jobs = max_jobs
+        self.ttl = ttl_hours * 3600
+        self.jobs = collections.OrderedDict()
+    
+    async def save(self, job_id, job, logs=None):
+        entry = self.jobs.pop(job_id, None)
+        if logs is None:
+            logs = entry["logs"] if entry is not None else []
+        # A snapshot, as a running import keeps changing its lists
+        self.jobs[job_id] = {"job": copy.deepcopy(job), "logs": logs[-JOB_LOG_LINES:], "updated": time.monotonic()}
+        # The least recently used jobs are dropped first
+        while len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last=False)
+        self.notify(job_id)
+    
+    def entry(self, job_id):
+        entry = self.jobs.get(job_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["updated"] > self.ttl:
+            del self.jobs[job_id]
+            return None
+        self.jobs.move_to_end(job_id)
+        return entry
+    
+    async def get(self, job_id):
+        entry = self.entry(job_id)
+        return entry["job"] if entry is not None else None
+    
+    async def get_logs(self, job_id):
+        entry = self.entry(job_id)
+        return entry["logs"] if entry is not None else None
+
+# Class keeping jobs in a SQLite file, so they survive restarts
+class SQLiteJobStore(JobStore):
+    def __init__(self, path=JOB_STORE_PATH, max_jobs=JOB_RETENTION_COUNT, ttl_hours=JOB_RETENTION_HOURS):
+        super().__init__()
+        self.path = path
+        self.max_jobs = max_jobs
+        self.ttl = ttl_hours * 3600
+        self.db = None
+        # One connection is shared by the worker threads, one statement at a time
+        self.lock = threading.Lock()
+    
+    async def start(self):
+        await asyncio.to_thread(self.open)
+    
+    def open(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS import_jobs (
+                    job_id text PRIMARY KEY,
+                    job text NOT NULL,
+                    logs text NOT NULL,
+                    updated_at real NOT NULL
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS import_jobs_updated_at ON import_jobs (updated_at)")
+            
+            # Jobs that were running when the API stopped will never finish
+            interrupted = 0
+            for job_id, job in self.db.execute("SELECT job_id, job FROM import_jobs").fetchall():
+                job = json.loads(job)
+                if job["status"] in ACTIVE_STATUSES:
+                    self.db.execute("UPDATE import_jobs SET job = ? WHERE job_id = ?",
+                                    (json.dumps(interrupted_job(job)), job_id))
+                    interrupted += 1
+        if interrupted:
+            logger.warning(f"Marked {interrupted} import jobs interrupted by a restart as failed")
+    
+    async def close(self):
+        if self.db is not None:
+            await asyncio.to_thread(self.db.close)
+    
+    async def save(self, job_id, job, logs=None):
+        await asyncio.to_thread(self.write, job_id, job, logs)
+        self.notify(job_id)
+    
+    def write(self, job_id, job, logs):
+        now = time.time()
+        with self.lock, self.db:
+            if logs is None:
+                self.db.execute("""
+                    INSERT INTO import_jobs (job_id, job, logs, updated_at) VALUES (?, ?, '[]', ?)
+                    ON CONFLICT (job_id) DO UPDATE SET job = excluded.job, updated_at = excluded.updated_at
+                """, (job_id, json.dumps(job), now))
+            else:
+                self.db.execute("""
+                    INSERT OR REPLACE INTO import_jobs (job_id, job, logs, updated_at) VALUES (?, ?, ?, ?)
+                """, (job_id, json.dumps(job), json.dumps(logs[-JOB_LOG_LINES:]), now))
+            
+            # Apply the retention limits
+            self.db.execute("DELETE FROM import_jobs WHERE updated_at < ?", (now - self.ttl,))
+            self.db.execute("""
+                DELETE FROM import_jobs WHERE job_id NOT IN (
+                    SELECT job_id FROM import_jobs ORDER BY updated_at DESC LIMIT ?)
+            """, (self.max_jobs,))
+    
+    async def get(self, job_id):
+        row = await asyncio.to_thread(self.read, "job", job_id)
+        return json.loads(row) if row is not None else None
+    
+    async def get_logs(self, job_id):
+        row = await asyncio.to_thread(self.read, "logs", job_id)
+        return json.loads(row) if row is not None else None
+    
+    def read(self, column, job_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {column} FROM import_jobs WHERE job_id = ? AND updated_at >= ?",
+                                  (job_id, time.time() - self.ttl)).fetchone()
+        return row[0] if row is not None else None
+
+# Class keeping jobs in PostgreSQL, shared by every API worker and replica
+class PostgresJobStore(JobStore):
+    """Jobs are read and written through a small pool of their own, so a busy
+    import cannot starve its own progress reports or the status requests;
+    every wait on it gives up after JOB_STORE_TIMEOUT.
+
+    Every save sends a NOTIFY on the JOB_TABLE channel, which each worker
+    LISTENs to on a connection of its own to wake the requests watching
+    that job.
+
+    Running jobs save their progress every JOB_PROGRESS_SECONDS; one that
+    has been silent for JOB_STALE_SECONDS lost its worker and is reported
+    as failed.
+    """
+    def __init__(self, max_jobs=JOB_RETENTION_COUNT, ttl_hours=JOB_RETENTION_HOURS):
+        super().__init__()
+        self.pool = None
+        self.max_jobs = max_jobs
+        self.ttl = ttl_hours * 3600
+        self.ready = False
+        self.listener = None
+        self.lock = asyncio.Lock()
+    
+    async def start(self):
+        """Create the job table and start listening; failures are retried on first use"""
+        try:
+            await self.get_pool()
+            await self.listen()
+        except Exception as e:
+            logger.warning(f"Could not prepare the job store: {e}")
+    
+    async def get_pool(self):
+        async with self.lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    PG_CONN_STRING, min_size=1, max_size=JOB_POOL_SIZE,
+                    timeout=JOB_STORE_TIMEOUT, command_timeout=JOB_STORE_TIMEOUT)
+            pool = self.pool
+            if not self.ready:
+                await pool.execute(f"""
+                    CREATE TABLE IF NOT EXISTS "{JOB_TABLE}" (
+                        job_id text PRIMARY KEY,
+                        status text NOT NULL,
+                        job jsonb NOT NULL,
+                        logs jsonb NOT NULL DEFAULT '[]',
+                        updated_at timestamptz NOT NULL DEFAULT now()
+                    )
+                """)
+                await pool.execute(f'CREATE INDEX IF NOT EXISTS "{JOB_TABLE}_updated_at" ON "{JOB_TABLE}" (updated_at)')
+                self.ready = True
+        return pool
+    
+    async def listen(self):
+        """Make sure this worker hears about jobs saved by the others"""
+        async with self.lock:
+            if self.listener is None or self.listener.is_closed():
+                self.listener = await asyncpg.connect(PG_CONN_STRING, timeout=JOB_STORE_TIMEOUT)
+                await self.listener.add_listener(JOB_TABLE, self.on_notification)
+    
+    def on_notification(self, connection, pid, channel, job_id):
+        self.notify(job_id)
+    
+    @contextlib.asynccontextmanager
+    async def watch(self, job_id):
+        try:
+            await self.listen()
+        except Exception as e:
+            # Watchers then wait for their timeout
+            logger.warning(f"Could not listen for job updates: {e}")
+        async with super().watch(job_id) as event:
+            yield event
+    
+    async def close(self):
+        if self.listener is not None and not self.listener.is_closed():
+            await self.listener.close()
+        if self.pool is not None:
+            await self.pool.close()
+    
+    async def save(self, job_id, job, logs=None):
+        pool = await self.get_pool()
+        async with pool.acquire(timeout=JOB_STORE_TIMEOUT) as conn:
+            async with conn.transaction():
+                await conn.execute(f"""
+                    INSERT INTO "{JOB_TABLE}" (job_id, status, job, logs, updated_at)
+                    VALUES ($1, $2, $3::jsonb, coalesce($4::jsonb, '[]'), now())
+                    ON CONFLICT (job_id) DO UPDATE SET
+                        status = EXCLUDED.status, job = EXCLUDED.job,
+                        logs = coalesce($4::jsonb, "{JOB_TABLE}".logs), updated_at = now()
+                """, job_id, job["status"], json.dumps(job),
+                    json.dumps(logs[-JOB_LOG_LINES:]) if logs is not None else None)
+                # Delivered to the listeners when the transaction commits
+                await conn.execute("SELECT pg_notify($1, $2)", JOB_TABLE, job_id)
+                
+                # Apply the retention limits
+                await conn.execute(f"""
+                    DELETE FROM "{JOB_TABLE}" WHERE updated_at < now() - make_interval(secs => $1)
+                """, self.ttl)
+                await conn.execute(f"""
+                    DELETE FROM "{JOB_TABLE}" WHERE job_id IN (
+                        SELECT job_id FROM "{JOB_TABLE}" ORDER BY updated_at DESC OFFSET $1)
+                """, self.max_jobs)
+    
+    async def get(self, job_id):
+        pool = await self.get_pool()
+        async with pool.acquire(timeout=JOB_STORE_TIMEOUT) as conn:
+            row = await conn.fetchrow(f"""
+                SELECT job, updated_at < now() - make_interval(secs => $2) AS stale
+                FROM "{JOB_TABLE}"
+                WHERE job_id = $1 AND updated_at >= now() - make_interval(secs => $3)
+            """, job_id, JOB_STALE_SECONDS, self.ttl)
+        if row is None:
+            return None
+        job = json.loads(row['job'])
+        if row['stale'] and job["status"] in ACTIVE_STATUSES:
+            return interrupted_job(job, "Job stopped reporting progress, its worker was probably stopped")
+        return job
+    
+    async def get_logs(self, job_id):
+        pool = await self.get_pool()
+        async with pool.acquire(timeout=JOB_STORE_TIMEOUT) as conn:
+            logs = await conn.fetchval(f"""
+                SELECT logs FROM "{JOB_TABLE}"
+                WHERE job_id = $1 AND updated_at >= now() - make_interval(secs => $2)
+            """, job_id, self.ttl)
+        return json.loads(logs) if logs is not None else None
+
+def interrupted_job(job, message="Job interrupted by a restart of the API"):
+    """A job that stopped running without a result, marked failed"""
+    result = job.get("result") or {**job.get("progress", {}), "start_time": job["start_time"]}
+    return {
+        **job,
+        "status": "failed",
+        "result": {**result, "status": "failed", "end_time": datetime.now().isoformat(),
+                   "errors": result.get("errors", []) + [message]},
+    }
+
+def create_job_store():
+    """Job store selected by JOB_STORE"""
+    if JOB_STORE == "postgres":
+        return PostgresJobStore()
+    if JOB_STORE == "sqlite":
+        return SQLiteJobStore()
+    if JOB_STORE != "memory":
+        logger.warning(f"Unknown JOB_STORE {JOB_STORE}, keeping jobs in memory")
+    return MemoryJobStore()
@@ -1,21 +1,42 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException
 from pydantic import BaseModel
 import asyncio
+import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime
+from contextlib import asynccontextmanager, suppress
 import uuid
 
-from app.import_script import run_import
+from app.import_script import run_import, ConnectionManager, ImportResult
+from app.job_store import create_job_store, ACTIVE_STATUSES, JOB_PROGRESS_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Longest a status request waits for a running job to change
+MAX_STATUS_WAIT = 60
+
+# Database pool and SFTP connection shared by all import jobs
+connections = ConnectionManager()
+
+# Store for active and completed imports, bounded by the JOB_RETENTION_* settings;
+# with JOB_STORE=postgres it is shared by all workers and replicas
+job_store = create_job_store()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_store.start()
+    await connections.start()
+    yield
+    await connections.close()
+    await job_store.close()
 
 app = FastAPI(
     title="CSV Import API",
     description="API to trigger and monitor CSV imports from SFTP to PostgreSQL",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Store for active and completed imports
-import_tasks = {}
-
 class ImportResponse(BaseModel):
     """Response with import job information"""
     job_id: str
@@ -25,97 +46,143 @@ class ImportResponse(BaseModel):
     duration_seconds: Optional[float] = None
     downloaded_files: List[str] = []
     processed_files: List[tuple] = []
+    skipped_files: List[str] = []
+    failed_files: List[str] = []
     errors: List[str] = []
     row_counts: Optional[Dict[str, int]] = None
+    parse_throughput: Optional[Dict[str, Dict[str, Any]]] = None
+    transfer_rates: Optional[Dict[str, Dict[str, Any]]] = None
     log_lines: Optional[int] = None
 
 @app.get("/")
 async def root():
     return {"message": "Data Import API is running"}
 
+@app.get("/health")
+async def health():
+    """Check the database and SFTP connections"""
+    status = await connections.health()
+    healthy = all(value == "ok" for value in status.values())
+    return {"status": "ok" if healthy else "degraded", **status}
+
 @app.post("/import", response_model=ImportResponse)
-async def start_import(background_tasks: BackgroundTasks):
-    """Start a new import job"""
+async def start_import(background_tasks: BackgroundTasks, force: bool = False):
+    """Start a new import job
+
+    Set force to re-import files that are unchanged since the last import.
+    """
     job_id = str(uuid.uuid4())
     
     # Create placeholder for job
-    import_tasks[job_id] = {
+    job = {
         "status": "starting",
         "start_time": datetime.now().isoformat(),
         "result": None
     }
+    await job_store.save(job_id, job, [])
     
     # Run import in background
-    background_tasks.add_task(run_import_job, job_id)
+    background_tasks.add_task(run_import_job, job_id, job["start_time"], force)
     
     return {
         "job_id": job_id,
         "status": "starting",
-        "start_time": import_tasks[job_id]["start_time"],
+        "start_time": job["start_time"],
         "log_lines": 0
     }
 
 @app.get("/import/{job_id}", response_model=ImportResponse)
-async def get_import_status(job_id: str):
-    """Get status of an import job"""
-    if job_id not in import_tasks:
-        raise HTTPException(status_code=404, detail="Import job not found")
-    
-    job = import_tasks[job_id]
+async def get_import_status(job_id: str, wait: float = 0):
+    """Get status of an import job
+
+    Set wait to hold the response for a running job until its next update,
+    for at most that many seconds.
+    """
+    async with job_store.watch(job_id) as updated:
+        job = await job_store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Import job not found")
+        
+        if wait > 0 and job["status"] in ACTIVE_STATUSES:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(updated.wait(), min(wait, MAX_STATUS_WAIT))
+            job = await job_store.get(job_id) or job
     
     # If job is completed, return full result
     if job["result"] is not None:
-        result_dict = job["result"].to_dict()
-        return {
-            "job_id": job_id,
-            "status": result_dict["status"],
-            "start_time": result_dict["start_time"],
-            "end_time": result_dict["end_time"],
-            "duration_seconds": result_dict["duration_seconds"],
-            "downloaded_files": result_dict["downloaded_files"],
-            "processed_files": result_dict["processed_files"],
-            "errors": result_dict["errors"],
-            "row_counts": result_dict["row_counts"],
-            "log_lines": len(result_dict["log_messages"])
-        }
+        return {"job_id": job_id, **job["result"]}
     
-    # Otherwise return basic info
+    # Otherwise return basic info, with the progress of a running job
     return {
+        "log_lines": 0,
+        **job.get("progress", {}),
         "job_id": job_id,
         "status": job["status"],
-        "start_time": job["start_time"],
-        "log_lines": 0
+        "start_time": job["start_time"]
     }
 
 @app.get("/import/{job_id}/logs")
 async def get_import_logs(job_id: str):
     """Get logs for an import job"""
-    if job_id not in import_tasks:
+    job = await job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Import job not found")
     
-    job = import_tasks[job_id]
-    
-    if job["result"] is not None:
-        return {"logs": job["result"].log_messages}
+    logs = await job_store.get_logs(job_id)
+    if job["result"] is None and not logs:
+        return {"logs": ["Job still starting, no logs available"]}
     
-    return {"logs": ["Job still starting, no logs available"]}
+    return {"logs": logs or []}
+
+def job_summary(result: ImportResult):
+    """Result of an import job as stored, without its log lines"""
+    summary = result.to_dict()
+    del summary["log_messages"]
+    summary["log_lines"] = len(result.log_messages)
+    return summary
+
+def running_job(start_time: str, result: ImportResult):
+    progress = job_summary(result)
+    for key in ("status", "start_time", "end_time", "duration_seconds"):
+        del progress[key]
+    return {"status": "running", "start_time": start_time, "result": None, "progress": progress}
+
+async def report_progress(job_id: str, start_time: str, result: ImportResult):
+    """Save the progress of a running job every JOB_PROGRESS_SECONDS
+
+    The updates also show other workers that the job is still alive.
+    """
+    while True:
+        await asyncio.sleep(JOB_PROGRESS_SECONDS)
+        try:
+            await job_store.save(job_id, running_job(start_time, result), result.log_messages)
+        except Exception as e:
+            logger.warning(f"Could not save the progress of import job {job_id}: {e}")
 
-async def run_import_job(job_id: str):
+async def run_import_job(job_id: str, start_time: str, force: bool = False):
     """Execute the import job and update its status"""
+    result = ImportResult()
     try:
-        import_tasks[job_id]["status"] = "running"
-        result = await run_import()
-        import_tasks[job_id]["result"] = result
-        import_tasks[job_id]["status"] = result.status
+        await job_store.save(job_id, running_job(start_time, result))
+        progress = asyncio.create_task(report_progress(job_id, start_time, result))
+        try:
+            await run_import(force, connections, result)
+        finally:
+            progress.cancel()
+            await asyncio.gather(progress, return_exceptions=True)
+        await job_store.save(job_id, {"status": result.status, "start_time": start_time,
+                                      "result": job_summary(result)}, result.log_messages)
     except Exception as e:
         # Handle any unexpected errors
-        import_tasks[job_id]["status"] = "failed"
-        if import_tasks[job_id]["result"] is None:
-            # If no result object exists, create one
-            import_tasks[job_id]["result"] = {
+        message = f"Unexpected error: {str(e)}"
+        await job_store.save(job_id, {
+            "status": "failed",
+            "start_time": start_time,
+            "result": {
                 "status": "failed",
-                "start_time": import_tasks[job_id]["start_time"],
+                "start_time": start_time,
                 "end_time": datetime.now().isoformat(),
-                "errors": [f"Unexpected error: {str(e)}"],
-                "log_messages": [f"ERROR: Unexpected error: {str(e)}"]
+                "errors": result.errors + [message],
+                "log_lines": len(result.log_messages) + 1
             }
+        }, result.log_messages + [f"ERROR: {message}"])